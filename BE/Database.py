@@ -1,28 +1,104 @@
+import os
+import sys
 import sqlite3
 import csv
+import json
+import threading
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 import random
 from pathlib import Path
+from telemetry import timed_db
 
 DB_PATH = Path(__file__).parent / "log.db"
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "20000"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = 256  # số prepared statement sqlite3 giữ lại / connection
 
 
 # -----------------------------
 # DB CONNECTION
 # -----------------------------
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
+_local = threading.local()
+_all_connections = []
+_connections_lock = threading.Lock()
+
+
+def _connect():
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE,
+        check_same_thread=False,  # chỉ để close_db_connections() đóng được lúc shutdown
+    )
     conn.row_factory = sqlite3.Row
+    # WAL: reader không block writer và ngược lại; NORMAL là đủ an toàn với WAL
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    return conn
+
+
+def get_db_connection():
+    """
+    Connection dùng chung theo thread (mỗi thread giữ 1 connection, tái sử dụng giữa các lần gọi).
+    KHÔNG close connection này; ghi dữ liệu thì dùng transaction().
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.path != DB_PATH:
+        conn = _connect()
+        _local.conn, _local.path = conn, DB_PATH
+        with _connections_lock:
+            _all_connections.append(conn)
     return conn
 
 
+@contextmanager
+def transaction(immediate: bool = False):
+    """
+    Commit khi block chạy xong, rollback nếu lỗi.
+    - immediate: lấy write lock ngay từ đầu (BEGIN IMMEDIATE) cho read-then-write
+    """
+    conn = get_db_connection()
+    if immediate:
+        conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def close_db_connections():
+    """Đóng toàn bộ connection trong pool (gọi lúc shutdown)."""
+    with _connections_lock:
+        for conn in _all_connections:
+            try:
+                conn.close()
+            except Exception:
+                pass
+        _all_connections.clear()
+    _local.__dict__.clear()
+
+
 # -----------------------------
 # DB CREATION
 # -----------------------------
 def init_db():
-    conn = get_db_connection()
-    cur = conn.cursor()
+    # IMMEDIATE: nhiều process cùng start thì chỉ 1 process chạy migration
+    with transaction(immediate=True) as conn:
+        cur = conn.cursor()
+        create_schema(cur)
+        migrate(cur)
+
 
+def create_schema(cur):
+    """Schema gốc; mọi thay đổi sau đó nằm trong MIGRATIONS."""
     # bảng query_logs để log các câu hỏi
     cur.execute(
         """CREATE TABLE IF NOT EXISTS query_logs (
@@ -51,110 +127,285 @@ def init_db():
             document_name TEXT,
             status TEXT NOT NULL,
             last_modified TIMESTAMP,
+            content_hash TEXT,
+            payload TEXT,
+            progress INTEGER DEFAULT 0,
+            message TEXT,
+            started_at DATETIME,
+            finished_at DATETIME,
             created_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )"""
     )
 
-    conn.commit()
-    conn.close()
+
+def ensure_column(cur, table: str, column: str, definition: str):
+    columns = [row[1] for row in cur.execute(f"PRAGMA table_info({table})")]
+    if column not in columns:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+# -----------------------------
+# DB MIGRATIONS
+# Version hiện tại lưu trong PRAGMA user_version; thêm migration mới vào cuối MIGRATIONS.
+# -----------------------------
+def migration_1_ingestion_jobs(cur):
+    # DB tạo trước khi có các cột content_hash / job
+    ensure_column(cur, "ingestion_logs", "content_hash", "TEXT")
+    ensure_column(cur, "ingestion_logs", "payload", "TEXT")
+    ensure_column(cur, "ingestion_logs", "progress", "INTEGER DEFAULT 0")
+    ensure_column(cur, "ingestion_logs", "message", "TEXT")
+    ensure_column(cur, "ingestion_logs", "started_at", "DATETIME")
+    ensure_column(cur, "ingestion_logs", "finished_at", "DATETIME")
+
+
+def migration_2_query_log_indexes(cur):
+    # Cột day (YYYY-MM-DD, UTC) lưu sẵn để lọc/group theo ngày bằng index thay vì DATE(timestamp)
+    ensure_column(cur, "query_logs", "day", "TEXT")
+    cur.execute("UPDATE query_logs SET day = DATE(timestamp) WHERE day IS NULL")
+
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_question_id ON query_logs(question_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_timestamp ON query_logs(timestamp)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_day ON query_logs(day)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_query_logs_flagged_day ON query_logs(flagged, day)")
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_ingestion_logs_document_id "
+        "ON ingestion_logs(document_id, created_at)"
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_ingestion_logs_status ON ingestion_logs(status, id)")
+
+
+def migration_3_daily_stats(cur):
+    # Rollup theo ngày cho report / trend / dashboard, được trigger cập nhật mỗi khi query_logs đổi
+    cur.execute(
+        """CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY,
+            total_queries INTEGER NOT NULL DEFAULT 0,
+            escalated INTEGER NOT NULL DEFAULT 0,
+            thumbs_up INTEGER NOT NULL DEFAULT 0,
+            thumbs_down INTEGER NOT NULL DEFAULT 0
+        )"""
+    )
+    cur.execute(
+        """CREATE TRIGGER IF NOT EXISTS trg_daily_stats_insert
+           AFTER INSERT ON query_logs
+           BEGIN
+               INSERT INTO daily_stats (day, total_queries, escalated, thumbs_up, thumbs_down)
+               VALUES (
+                   COALESCE(NEW.day, DATE(NEW.timestamp)), 1,
+                   NEW.flagged != 0, NEW.thumbs_up, NEW.thumbs_down
+               )
+               ON CONFLICT(day) DO UPDATE SET
+                   total_queries = total_queries + 1,
+                   escalated = escalated + excluded.escalated,
+                   thumbs_up = thumbs_up + excluded.thumbs_up,
+                   thumbs_down = thumbs_down + excluded.thumbs_down;
+           END"""
+    )
+    cur.execute(
+        """CREATE TRIGGER IF NOT EXISTS trg_daily_stats_update
+           AFTER UPDATE OF flagged, thumbs_up, thumbs_down ON query_logs
+           BEGIN
+               UPDATE daily_stats SET
+                   escalated = escalated + (NEW.flagged != 0) - (OLD.flagged != 0),
+                   thumbs_up = thumbs_up + NEW.thumbs_up - OLD.thumbs_up,
+                   thumbs_down = thumbs_down + NEW.thumbs_down - OLD.thumbs_down
+               WHERE day = COALESCE(NEW.day, DATE(NEW.timestamp));
+           END"""
+    )
+    cur.execute(
+        """CREATE TRIGGER IF NOT EXISTS trg_daily_stats_delete
+           AFTER DELETE ON query_logs
+           BEGIN
+               UPDATE daily_stats SET
+                   total_queries = total_queries - 1,
+                   escalated = escalated - (OLD.flagged != 0),
+                   thumbs_up = thumbs_up - OLD.thumbs_up,
+                   thumbs_down = thumbs_down - OLD.thumbs_down
+               WHERE day = COALESCE(OLD.day, DATE(OLD.timestamp));
+           END"""
+    )
+    rebuild_daily_stats(cur)
+
+
+def migration_4_ingestion_job_heartbeat(cur):
+    # Job running thuộc về worker nào + lần cuối worker đó còn sống, để chỉ requeue job bị bỏ dở
+    ensure_column(cur, "ingestion_logs", "worker_id", "TEXT")
+    ensure_column(cur, "ingestion_logs", "heartbeat_at", "DATETIME")
+
+
+MIGRATIONS = [
+    (1, migration_1_ingestion_jobs),
+    (2, migration_2_query_log_indexes),
+    (3, migration_3_daily_stats),
+    (4, migration_4_ingestion_job_heartbeat),
+]
+
+
+def migrate(cur):
+    version = cur.execute("PRAGMA user_version").fetchone()[0]
+    for target, migration in MIGRATIONS:
+        if target > version:
+            print(f"Applying DB migration {target}: {migration.__name__}")
+            migration(cur)
+            cur.execute(f"PRAGMA user_version = {target}")
+    cur.execute("ANALYZE")
+
+
+def rebuild_daily_stats(cur):
+    """Tính lại toàn bộ daily_stats từ query_logs (backfill / sửa lệch)."""
+    cur.execute("DELETE FROM daily_stats")
+    cur.execute(
+        """INSERT INTO daily_stats (day, total_queries, escalated, thumbs_up, thumbs_down)
+           SELECT COALESCE(day, DATE(timestamp)), COUNT(*), SUM(flagged != 0),
+                  SUM(thumbs_up), SUM(thumbs_down)
+           FROM query_logs
+           GROUP BY COALESCE(day, DATE(timestamp))"""
+    )
+    print(f"Rebuilt daily_stats: {cur.rowcount} day(s).")
+
+
+def backfill_daily_stats():
+    with transaction(immediate=True) as conn:
+        rebuild_daily_stats(conn.cursor())
 
 
 # -----------------------------
 # Query logs 
 # -----------------------------
-def log_query(
+def query_log_row(
     question_id: str,
     user_id: str,
     channel_id: str,
     query: str,
     answer: str,
     similarity_score: float,
-):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
+    log_id: int = None,
+) -> tuple:
+    """1 dòng query_logs theo thứ tự cột của insert_query_logs."""
     flagged = 1 if similarity_score < 50 else 0
+    now = datetime.now(timezone.utc)
+    return (
+        log_id,
+        question_id,
+        channel_id,
+        user_id,
+        query,
+        flagged,
+        similarity_score,
+        answer,
+        now.isoformat(),
+        now.date().isoformat(),
+    )
 
-    cursor.execute(
+
+def insert_query_logs(conn, rows: list):
+    """Insert nhiều dòng (log_id = None thì để AUTOINCREMENT tự cấp)."""
+    return conn.executemany(
         """INSERT INTO query_logs
-           (question_id, channel_id, user_id, question, flagged, similarity_score, answer, timestamp)
-           VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
-        (
-            question_id,
-            channel_id,
-            user_id,
-            query,
-            flagged,
-            similarity_score,
-            answer,
-            datetime.now(timezone.utc).isoformat(),
-        ),
+           (log_id, question_id, channel_id, user_id, question, flagged, similarity_score, answer, timestamp, day)
+           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+        rows,
     )
-    conn.commit()
-    log_id = cursor.lastrowid
-    conn.close()
-    return log_id
 
 
-# -----------------------------
-# Reaction Added
-# -----------------------------
-def update_reaction_added(question_id: str, thumbs_up: bool, thumbs_down: bool):
-    with sqlite3.connect(DB_PATH) as conn:
-        print({
-            "question_id": question_id,
-            "thumbs_up": thumbs_up,
-            "thumbs_down": thumbs_down
-            })
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE query_logs
-            SET 
-                thumbs_up   = thumbs_up + ?,
-                thumbs_down = thumbs_down + ?,
-                flagged = CASE 
-                            WHEN (thumbs_down + ?) > (thumbs_up + ?) THEN 1
-                            ELSE 0
-                          END
-            WHERE question_id = ?
-            """,
-            (
-                1 if thumbs_up else 0,   
-                1 if thumbs_down else 0, 
-                1 if thumbs_down else 0, 
-                1 if thumbs_up else 0,   
-                question_id,
-            ),
+@timed_db
+def log_query(
+    question_id: str,
+    user_id: str,
+    channel_id: str,
+    query: str,
+    answer: str,
+    similarity_score: float,
+):
+    row = query_log_row(question_id, user_id, channel_id, query, answer, similarity_score)
+    with transaction() as conn:
+        cursor = conn.execute(
+            """INSERT INTO query_logs
+               (log_id, question_id, channel_id, user_id, question, flagged, similarity_score, answer, timestamp, day)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+            row,
         )
+    return cursor.lastrowid
+
+
+@timed_db
+def allocate_log_ids(count: int) -> range:
+    """
+    Cấp trước 1 block log_id cho log writer bằng cách đẩy sqlite_sequence của query_logs lên,
+    nên các insert AUTOINCREMENT khác (log_query, mock data) không bao giờ đụng block này.
+    """
+    with transaction(immediate=True) as conn:
+        row = conn.execute(
+            """SELECT MAX(
+                   COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'query_logs'), 0),
+                   COALESCE((SELECT MAX(log_id) FROM query_logs), 0)
+               )"""
+        ).fetchone()
+        start = row[0] + 1
+        end = start + count - 1
+        updated = conn.execute(
+            "UPDATE sqlite_sequence SET seq = ? WHERE name = 'query_logs'", (end,)
+        ).rowcount
+        if not updated:
+            conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('query_logs', ?)", (end,))
+    return range(start, end + 1)
+
+
+@timed_db
+def update_query_confidence(log_id: int, similarity_score: float):
+    """Backfill confidence cuối cùng khi LLM confidence được chấm ở background."""
+    with transaction() as conn:
+        update_query_confidences(conn, [(log_id, similarity_score)])
+
+
+def update_query_confidences(conn, updates: list):
+    """updates: list (log_id, similarity_score)."""
+    return conn.executemany(
+        """
+        UPDATE query_logs
+        SET
+            similarity_score = ?,
+            flagged = CASE
+                        WHEN ? < 50 OR thumbs_down > thumbs_up THEN 1
+                        ELSE 0
+                      END
+        WHERE log_id = ?
+        """,
+        [(score, score, log_id) for log_id, score in updates],
+    )
 
 
 # -----------------------------
-# Reaction Removed
+# Reaction deltas (batched)
 # -----------------------------
-def update_reaction_removed(question_id: str, thumbs_up: bool, thumbs_down: bool):
-    with sqlite3.connect(DB_PATH) as conn:
+@timed_db
+def apply_reaction_deltas(deltas: dict) -> list:
+    """
+    Ghi net delta {question_id: (thumbs_up_delta, thumbs_down_delta)} trong 1 transaction.
+    Trả về các question_id chưa có dòng trong query_logs để buffer retry lần sau.
+    """
+    missing = []
+    with transaction(immediate=True) as conn:
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE query_logs
-            SET 
-                thumbs_up   = MAX(thumbs_up - ?, 0),
-                thumbs_down = MAX(thumbs_down - ?, 0),
-                flagged = CASE 
-                            WHEN MAX(thumbs_down - ?, 0) > MAX(thumbs_up - ?, 0) THEN 1
-                            ELSE 0
-                          END
-            WHERE question_id = ?
-            """,
-            (
-                1 if thumbs_up else 0,
-                1 if thumbs_down else 0,
-                1 if thumbs_down else 0,
-                1 if thumbs_up else 0,
-                question_id,
-            ),
-        )
-        print("Rows updated (remove):", cursor.rowcount)
+        for question_id, (up, down) in deltas.items():
+            cursor.execute(
+                """
+                UPDATE query_logs
+                SET 
+                    thumbs_up   = MAX(thumbs_up + ?, 0),
+                    thumbs_down = MAX(thumbs_down + ?, 0),
+                    flagged = CASE 
+                                WHEN MAX(thumbs_down + ?, 0) > MAX(thumbs_up + ?, 0) THEN 1
+                                ELSE 0
+                              END
+                WHERE question_id = ?
+                """,
+                (up, down, down, up, question_id),
+            )
+            if cursor.rowcount == 0:
+                missing.append(question_id)
+    return missing
+
 
 # -----------------------------
 # Update logs status when export.
@@ -208,55 +459,41 @@ def update_reaction_removed(question_id: str, thumbs_up: bool, thumbs_down: bool
 # -----------------------------
 # Ingestion logs
 # -----------------------------
-def insert_ingestion_log(
-    source: str,
-    document_id: str,
-    document_type: str,
-    document_name: str,
-    status: str,
-    last_modified: datetime,
-):
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    last_modified_str = last_modified.isoformat() if last_modified else None
-
-    cursor.execute(
-        """INSERT INTO ingestion_logs
-              (source, document_id, document_type, document_name, status, last_modified, created_at)
-           VALUES (?, ?, ?, ?, ?, ?, ?)""",
-        (
-            source,
-            document_id,
-            document_type,
-            document_name,
-            status,
-            last_modified_str,
-            datetime.now(timezone.utc).isoformat(),
-        ),
-    )
-    conn.commit()
-    conn.close()
-
-def should_ingest(document_id: str, last_modified: datetime) -> bool:
+@timed_db
+def should_ingest(document_id: str, last_modified: datetime, content_hash: str = None) -> bool:
     """
     Kiểm tra xem document có cần ingest lại không
     - document_id: id duy nhất của tài liệu (ví dụ path, fileId, ...)
     - last_modified: thời gian chỉnh sửa cuối cùng của tài liệu (datetime)
+    - content_hash: hash nội dung tài liệu (nếu có)
     
     Return:
         True  -> nếu chưa có trong ingestion_logs hoặc có thay đổi mới
-        False -> nếu bản mới nhất trong DB vẫn còn valid (status='success' và last_modified trùng)
+        False -> nếu bản mới nhất trong DB vẫn còn valid (status='success' và
+                 cùng content_hash, hoặc last_modified trùng khi không có hash)
     """
-    history = get_ingestion_history(document_id)
+    # Bỏ qua job đang chờ/chạy, chỉ xét các lần ingest đã kết thúc
+    history = [
+        h for h in get_ingestion_history(document_id)
+        if h.get("status") not in PENDING_JOB_STATUSES
+    ]
     if not history:
         return True  # chưa từng ingest
 
     latest = history[0]  # bản gần nhất
     latest_status = latest.get("status")
     latest_modified = latest.get("last_modified")
+    latest_hash = latest.get("content_hash")
 
-    # Nếu bản cũ failed hoặc không có last_modified => cần ingest lại
-    if latest_status != "success" or not latest_modified:
+    if latest_status != "success":
+        return True
+
+    # Có hash ở cả 2 phía => chỉ ingest lại khi nội dung thật sự đổi
+    if content_hash and latest_hash:
+        return content_hash != latest_hash
+
+    # Nếu không có last_modified => cần ingest lại
+    if not latest_modified:
         return True
 
     # So sánh last_modified
@@ -267,99 +504,262 @@ def should_ingest(document_id: str, last_modified: datetime) -> bool:
     return False
 
 
+@timed_db
 def get_ingestion_logs():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM ingestion_logs ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
+    conn = get_db_connection()
+    rows = conn.execute("SELECT * FROM ingestion_logs ORDER BY created_at DESC").fetchall()
     return [dict(row) for row in rows]
 
 
+@timed_db
 def get_ingestion_history(document_id: str):
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
-    cursor.execute(
+    conn = get_db_connection()
+    rows = conn.execute(
         "SELECT * FROM ingestion_logs WHERE document_id = ? ORDER BY created_at DESC",
         (document_id,),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    ).fetchall()
     return [dict(row) for row in rows]
 
-def insert_mock_data():
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-
-    # ---------------- Query Logs ----------------
-    sample_questions = [
-        ("q1", "user1", "channel1", "Làm sao cài Docker?", "Bạn có thể dùng Docker Desktop.", 78.5),
-        ("q2", "user2", "channel1", "Python lỗi Unicode?", "Dùng encoding='utf-8' khi mở file.", 62.3),
-        ("q3", "user3", "channel2", "Hãy giải thích về RAG?", "RAG = Retrieval-Augmented Generation.", 45.0),
-        ("q4", "user4", "channel2", "Test case khác test scenario thế nào?", "Scenario bao gồm nhiều test case.", 88.1),
-        ("q5", "user5", "channel3", "Làm sao ingest file PDF?", "Dùng hàm ingest_local_files().", 30.0),
-    ]
+# -----------------------------
+# Ingestion jobs (mỗi job là 1 dòng ingestion_logs)
+# status: queued -> running -> success / failed
+# -----------------------------
+PENDING_JOB_STATUSES = ("queued", "running")
 
-    for qid, uid, cid, q, a, score in sample_questions:
-        flagged = 1 if score < 50 else 0
-        cursor.execute(
-            """INSERT INTO query_logs
-               (question_id, channel_id, user_id, question, flagged, similarity_score, answer, thumbs_up, thumbs_down, status, timestamp)
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+
+@timed_db
+def enqueue_ingestion_job(
+    source: str,
+    document_id: str,
+    document_type: str,
+    document_name: str,
+    last_modified: datetime,
+    payload: dict,
+    content_hash: str = None,
+) -> tuple:
+    """
+    Enqueue job nếu document chưa có job queued/running (check + insert trong 1 transaction
+    immediate nên 2 request cùng lúc không tạo 2 job).
+    Return: (job_id, created) -> created False thì job_id là job đang chờ sẵn
+    """
+    with transaction(immediate=True) as conn:
+        cursor = conn.execute(
+            """INSERT INTO ingestion_logs
+                  (source, document_id, document_type, document_name, status,
+                   last_modified, content_hash, payload, progress, message, created_at)
+               SELECT ?, ?, ?, ?, 'queued', ?, ?, ?, 0, 'Queued', ?
+               WHERE NOT EXISTS (
+                   SELECT 1 FROM ingestion_logs
+                   WHERE document_id = ? AND status IN ('queued', 'running')
+               )""",
             (
-                qid,
-                cid,
-                uid,
-                q,
-                flagged,
-                score,
-                a,
-                random.randint(0, 5),
-                random.randint(0, 3),
-                "answered",
+                source,
+                document_id,
+                document_type,
+                document_name,
+                last_modified.isoformat() if last_modified else None,
+                content_hash,
+                json.dumps(payload),
                 datetime.now(timezone.utc).isoformat(),
+                document_id,
             ),
         )
+        if cursor.rowcount:
+            return cursor.lastrowid, True
+        row = conn.execute(
+            """SELECT id FROM ingestion_logs
+               WHERE document_id = ? AND status IN ('queued', 'running')
+               ORDER BY id DESC LIMIT 1""",
+            (document_id,),
+        ).fetchone()
+        return row[0], False
+
+
+@timed_db
+def claim_next_ingestion_job(worker_id: str):
+    """Lấy job queued cũ nhất và chuyển sang running cho worker_id (atomic giữa các worker/process)."""
+    now = datetime.now(timezone.utc).isoformat()
+    with transaction(immediate=True) as conn:
+        row = conn.execute(
+            "SELECT * FROM ingestion_logs WHERE status = 'queued' ORDER BY id LIMIT 1"
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            """UPDATE ingestion_logs
+               SET status = 'running', message = 'Started', started_at = ?,
+                   worker_id = ?, heartbeat_at = ?
+               WHERE id = ?""",
+            (now, worker_id, now, row["id"]),
+        )
 
-    # ---------------- Ingestion Logs ----------------
-    sample_docs = [
-        ("local", "doc1", "pdf", "Docker Guide.pdf", "success"),
-        ("local", "doc2", "txt", "Unicode Notes.txt", "success"),
-        ("gdrive", "doc3", "pptx", "AI Presentation.pptx", "failed"),
-        ("local", "doc4", "pdf", "ISTQB Foundation.pdf", "success"),
-    ]
+    job = dict(row)
+    job["status"] = "running"
+    job["worker_id"] = worker_id
+    job["payload"] = json.loads(job["payload"]) if job["payload"] else {}
+    return job
 
-    now = datetime.now(timezone.utc)
-    for source, did, dtype, name, status in sample_docs:
-        cursor.execute(
-            """INSERT INTO ingestion_logs
-               (source, document_id, document_type, document_name, status, last_modified, created_at)
-               VALUES (?, ?, ?, ?, ?, ?, ?)""",
-            (
-                source,
-                did,
-                dtype,
-                name,
-                status,
-                (now - timedelta(days=random.randint(0, 30))).isoformat(),
-                now.isoformat(),
-            ),
+
+@timed_db
+def update_ingestion_job(job_id: int, status: str = None, progress: int = None, message: str = None,
+                         worker_id: str = None, content_hash: str = None) -> bool:
+    """
+    Cập nhật job + refresh heartbeat. Có worker_id thì chỉ ghi khi job vẫn thuộc worker đó
+    (job đã bị requeue cho worker khác thì return False).
+    content_hash: hash tính trong job (vd. checksum Drive), để should_ingest lần sau so sánh.
+    """
+    now = datetime.now(timezone.utc).isoformat()
+    finished_at = now if status in ("success", "failed") else None
+    with transaction() as conn:
+        cursor = conn.execute(
+            """UPDATE ingestion_logs
+               SET status = COALESCE(?, status),
+                   progress = COALESCE(?, progress),
+                   message = COALESCE(?, message),
+                   content_hash = COALESCE(?, content_hash),
+                   finished_at = COALESCE(?, finished_at),
+                   heartbeat_at = ?
+               WHERE id = ? AND (? IS NULL OR worker_id = ?)""",
+            (status, progress, message, content_hash, finished_at, now, job_id, worker_id, worker_id),
+        )
+        return cursor.rowcount > 0
+
+
+@timed_db
+def heartbeat_ingestion_jobs(worker_id: str) -> int:
+    """Worker còn sống: refresh heartbeat mọi job running của nó."""
+    with transaction() as conn:
+        cursor = conn.execute(
+            """UPDATE ingestion_logs SET heartbeat_at = ?
+               WHERE status = 'running' AND worker_id = ?""",
+            (datetime.now(timezone.utc).isoformat(), worker_id),
+        )
+        return cursor.rowcount
+
+
+@timed_db
+def requeue_stale_jobs(timeout: float) -> int:
+    """Job running mà worker không heartbeat quá timeout giây (process đã chết) -> queued để chạy lại."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=timeout)).isoformat()
+    with transaction(immediate=True) as conn:
+        cursor = conn.execute(
+            """UPDATE ingestion_logs
+               SET status = 'queued', worker_id = NULL, message = 'Requeued after worker timeout'
+               WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)""",
+            (cutoff,),
         )
+        return cursor.rowcount
+
+
+@timed_db
+def get_ingestion_job(job_id: int):
+    conn = get_db_connection()
+    row = conn.execute(
+        """SELECT id AS job_id, source, document_id, document_type, document_name, status,
+                  progress, message, created_at, started_at, finished_at
+           FROM ingestion_logs WHERE id = ?""",
+        (job_id,),
+    ).fetchone()
+    return dict(row) if row else None
+
+
+@timed_db
+def list_ingestion_jobs(limit: int = 50, status: str = None):
+    conn = get_db_connection()
+    rows = conn.execute(
+        """SELECT id AS job_id, source, document_id, document_type, document_name, status,
+                  progress, message, created_at, started_at, finished_at
+           FROM ingestion_logs
+           WHERE payload IS NOT NULL AND (? IS NULL OR status = ?)
+           ORDER BY id DESC LIMIT ?""",
+        (status, status, limit),
+    ).fetchall()
+    return [dict(row) for row in rows]
+
+
+@timed_db
+def get_pending_ingestion_job(document_id: str):
+    """Job queued/running của document (nếu có), tránh enqueue trùng."""
+    conn = get_db_connection()
+    row = conn.execute(
+        """SELECT id FROM ingestion_logs
+           WHERE document_id = ? AND status IN ('queued', 'running')
+           ORDER BY id DESC LIMIT 1""",
+        (document_id,),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def insert_mock_data():
+    with transaction() as conn:
+        cursor = conn.cursor()
+
+        # ---------------- Query Logs ----------------
+        sample_questions = [
+            ("q1", "user1", "channel1", "Làm sao cài Docker?", "Bạn có thể dùng Docker Desktop.", 78.5),
+            ("q2", "user2", "channel1", "Python lỗi Unicode?", "Dùng encoding='utf-8' khi mở file.", 62.3),
+            ("q3", "user3", "channel2", "Hãy giải thích về RAG?", "RAG = Retrieval-Augmented Generation.", 45.0),
+            ("q4", "user4", "channel2", "Test case khác test scenario thế nào?", "Scenario bao gồm nhiều test case.", 88.1),
+            ("q5", "user5", "channel3", "Làm sao ingest file PDF?", "Dùng hàm ingest_local_files().", 30.0),
+        ]
+
+        for qid, uid, cid, q, a, score in sample_questions:
+            flagged = 1 if score < 50 else 0
+            cursor.execute(
+                """INSERT INTO query_logs
+                   (question_id, channel_id, user_id, question, flagged, similarity_score, answer, thumbs_up, thumbs_down, status, timestamp, day)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    qid,
+                    cid,
+                    uid,
+                    q,
+                    flagged,
+                    score,
+                    a,
+                    random.randint(0, 5),
+                    random.randint(0, 3),
+                    "answered",
+                    datetime.now(timezone.utc).isoformat(),
+                    datetime.now(timezone.utc).date().isoformat(),
+                ),
+            )
+
+        # ---------------- Ingestion Logs ----------------
+        sample_docs = [
+            ("local", "doc1", "pdf", "Docker Guide.pdf", "success"),
+            ("local", "doc2", "txt", "Unicode Notes.txt", "success"),
+            ("gdrive", "doc3", "pptx", "AI Presentation.pptx", "failed"),
+            ("local", "doc4", "pdf", "ISTQB Foundation.pdf", "success"),
+        ]
+
+        now = datetime.now(timezone.utc)
+        for source, did, dtype, name, status in sample_docs:
+            cursor.execute(
+                """INSERT INTO ingestion_logs
+                   (source, document_id, document_type, document_name, status, last_modified, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    source,
+                    did,
+                    dtype,
+                    name,
+                    status,
+                    (now - timedelta(days=random.randint(0, 30))).isoformat(),
+                    now.isoformat(),
+                ),
+            )
 
-    conn.commit()
-    conn.close()
     print("✅ Mock data inserted thành công!")
 
 
-def get_all_query_logs(db_path="log.db"):
+@timed_db
+def get_all_query_logs():
     """
     Lấy toàn bộ dữ liệu từ bảng query_logs
     Trả về: list các dict
     """
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Cho phép truy cập theo tên cột
+    conn = get_db_connection()
     cur = conn.cursor()
 
     cur.execute("SELECT * FROM query_logs")
@@ -367,7 +767,6 @@ def get_all_query_logs(db_path="log.db"):
 
     result = [dict(row) for row in rows]
 
-    conn.close()
     return result
 
 # -----------------------------
@@ -375,7 +774,10 @@ def get_all_query_logs(db_path="log.db"):
 # -----------------------------
 if __name__ == "__main__":
     init_db()
-    # logs = get_all_query_logs("log.db")
+    # python Database.py backfill-daily-stats -> tính lại rollup từ query_logs
+    if "backfill-daily-stats" in sys.argv[1:]:
+        backfill_daily_stats()
+    # logs = get_all_query_logs()
 
     # for log in logs:
     #     print(log)
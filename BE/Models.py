@@ -8,6 +8,9 @@ class Query(BaseModel):
     user_id: str
     question: str
 
+class QueryBatch(BaseModel):
+    queries: List[Query]
+
 class Reaction(BaseModel):
     question_id: str
     reaction_type: str
@@ -0,0 +1,145 @@
+"""
+Benchmark HNSW (ann_index.py) so với exact search (flat_index.py) trên corpus thật.
+
+Dùng flat index đã export trong thư mục Chroma (python embed.py export-flat-index),
+build HNSW cho từng cặp (M, ef_construction) ra file tạm rồi với từng ef_search đo:
+- recall@k so với top-k exact
+- latency mỗi query (mean / p50 / p90 / p95 / p99 / max) và QPS
+- thời gian build + kích thước index
+
+Query mặc định là vector lấy mẫu từ chính index (không cần load embedding model);
+--questions <file.jsonl> để dùng câu hỏi thật (field "question").
+
+Chạy:
+    python ann_benchmark.py
+    python ann_benchmark.py --m 16 32 --ef-construction 100 200 --ef-search 16 32 64 128 --k 5
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+from datetime import datetime, timezone
+import numpy as np
+from dotenv import load_dotenv
+from flat_index import get_flat_index
+from ann_index import HnswIndex, build_hnsw_index, HNSW_M, HNSW_EF_CONSTRUCTION, HNSW_EF_SEARCH
+from benchmark import BENCH_DIR, summarize, load_questions, git_commit
+
+load_dotenv()
+
+
+def query_vectors(flat, questions: Path, sample: int, seed: int):
+    if questions:
+        from embedder import get_embedding_model
+        texts = [item["question"] for item in load_questions(questions)]
+        return np.asarray(get_embedding_model().embed_documents(texts), dtype=np.float32)
+    rows = np.random.default_rng(seed).choice(flat.count, size=min(sample, flat.count), replace=False)
+    return np.stack([flat.vector(int(row)) for row in rows])
+
+
+def timed_search(index, queries, k: int) -> tuple:
+    """Search từng query một (như lúc serve), return (ids_per_query, latencies)."""
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        ids, _ = index.search([query], k)
+        latencies.append(time.perf_counter() - start)
+        results.append(ids[0])
+    return results, latencies
+
+
+def report_latency(latencies: list) -> dict:
+    total = sum(latencies)
+    return {
+        "latency": summarize(latencies),
+        "qps": round(len(latencies) / total, 2) if total else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HNSW against exact flat search.")
+    parser.add_argument("--persist-dir", default=os.getenv("CHROMA_DB_PATH"))
+    parser.add_argument("--questions", type=Path, default=None)
+    parser.add_argument("--sample", type=int, default=1000, help="số vector lấy mẫu làm query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--m", type=int, nargs="+", default=[HNSW_M])
+    parser.add_argument("--ef-construction", type=int, nargs="+", default=[HNSW_EF_CONSTRUCTION])
+    parser.add_argument("--ef-search", type=int, nargs="+",
+                        default=sorted({16, 32, HNSW_EF_SEARCH, 128, 256}))
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    flat = get_flat_index(args.persist_dir) if args.persist_dir else None
+    if flat is None or not flat.count:
+        raise SystemExit("No flat index found, run `python embed.py export-flat-index` first.")
+
+    queries = query_vectors(flat, args.questions, args.sample, args.seed)
+    exact_ids, exact_latencies = timed_search(flat, queries, args.k)
+    exact = [set(ids) for ids in exact_ids]
+    print(f"Exact: {len(queries)} queries over {flat.count} vectors, "
+          f"p50 {summarize(exact_latencies)['p50_ms']} ms")
+
+    runs = []
+    build_dir = tempfile.mkdtemp(prefix="ann_bench_")
+    try:
+        for m in args.m:
+            for ef_construction in args.ef_construction:
+                output = os.path.join(build_dir, f"hnsw_m{m}_ef{ef_construction}.bin")
+                build = build_hnsw_index(flat.path, m, ef_construction, output=output)
+                index = HnswIndex(flat, path=output)
+                for ef_search in args.ef_search:
+                    index.set_ef(ef_search)
+                    ids_per_query, latencies = timed_search(index, queries, args.k)
+                    recall = np.mean([
+                        len(exact[i] & set(ids)) / len(exact[i]) for i, ids in enumerate(ids_per_query)
+                    ])
+                    run = {
+                        "m": m,
+                        "ef_construction": ef_construction,
+                        "ef_search": max(ef_search, args.k),  # hnswlib search với ef >= k
+                        f"recall_at_{args.k}": round(float(recall), 4),
+                        "build_seconds": build["build_seconds"],
+                        "index_size_mb": round(build["size_bytes"] / (1024 * 1024), 2),
+                        **report_latency(latencies),
+                    }
+                    runs.append(run)
+                    print(f"M={m} ef_construction={ef_construction} ef_search={run['ef_search']}: "
+                          f"recall@{args.k} {run[f'recall_at_{args.k}']}, "
+                          f"p50 {run['latency']['p50_ms']} ms, {run['qps']} qps")
+                del index
+                os.remove(output)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "config": {
+            "persist_dir": args.persist_dir,
+            "flat_version": flat.version,
+            "vectors": flat.count,
+            "dim": flat.dim,
+            "dtype": flat.dtype,
+            "queries": len(queries),
+            "query_source": str(args.questions) if args.questions else "sampled_vectors",
+            "k": args.k,
+        },
+        "exact": report_latency(exact_latencies),
+        "hnsw": runs,
+    }
+    output = args.output or BENCH_DIR / "results" / (
+        f"ann_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{commit}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"Saved ANN benchmark results → {output}")
+
+
+if __name__ == "__main__":
+    main()
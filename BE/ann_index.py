@@ -0,0 +1,129 @@
+import os
+import json
+import time
+import threading
+import numpy as np
+from dotenv import load_dotenv
+from flat_index import get_flat_index
+
+try:
+    import hnswlib
+except ImportError:  # không có hnswlib thì VECTOR_BACKEND=hnsw quay về exact search trên flat index
+    hnswlib = None
+
+load_dotenv()
+
+# ==== CONFIG ====
+# Build: M lớn / ef_construction lớn -> recall cao hơn, build lâu và tốn RAM hơn
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+# Search: ef_search lớn -> recall cao hơn, query chậm hơn (luôn >= k)
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", "64"))
+HNSW_BUILD_THREADS = int(os.getenv("HNSW_BUILD_THREADS", "0")) or -1  # -1 = mọi core
+HNSW_BUILD_BATCH = 50000
+
+HNSW_FILE = "hnsw.bin"
+HNSW_PARAMS_FILE = "hnsw.json"
+
+
+def build_hnsw_index(path: str, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                     output: str = None) -> dict:
+    """
+    Build HNSW (inner product trên vector đã normalize = cosine) từ vectors.npy của 1 version
+    flat index; label = số thứ tự dòng nên metadata dùng chung với flat index.
+    Return: params + thời gian build, cũng được ghi ra hnsw.json
+    """
+    if hnswlib is None:
+        raise RuntimeError("hnswlib is not installed.")
+
+    with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    count, dim = manifest["count"], manifest["dim"]
+    vectors = scales = None
+    if count:
+        vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")[:count]
+        if manifest["dtype"] == "int8":
+            scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")[:count]
+
+    start = time.perf_counter()
+    index = hnswlib.Index(space="ip", dim=max(dim, 1))
+    index.init_index(max_elements=max(count, 1), M=m, ef_construction=ef_construction)
+    for lo in range(0, count, HNSW_BUILD_BATCH):
+        batch = np.asarray(vectors[lo:lo + HNSW_BUILD_BATCH], dtype=np.float32)
+        if scales is not None:
+            batch *= scales[lo:lo + len(batch), None]
+        index.add_items(batch, np.arange(lo, lo + len(batch)), num_threads=HNSW_BUILD_THREADS)
+
+    output = output or os.path.join(path, HNSW_FILE)
+    index.save_index(output)
+    params = {
+        "m": m,
+        "ef_construction": ef_construction,
+        "count": count,
+        "build_seconds": round(time.perf_counter() - start, 3),
+        "size_bytes": os.path.getsize(output),
+    }
+    if output == os.path.join(path, HNSW_FILE):
+        with open(os.path.join(path, HNSW_PARAMS_FILE), "w", encoding="utf-8") as f:
+            json.dump(params, f, indent=2)
+    print(f"HNSW index built: {count} vectors (M={m}, ef_construction={ef_construction}) in {params['build_seconds']}s")
+    return params
+
+
+class HnswIndex:
+    """
+    ANN trên 1 version flat index: HNSW chỉ trả về số dòng, text / metadata / vector đọc từ flat index.
+    Cùng interface search / get với FlatIndex nên bot.py dùng thay thế được.
+    """
+
+    def __init__(self, flat, path: str = None, ef_search: int = HNSW_EF_SEARCH):
+        self.flat = flat
+        self.version = flat.version
+        self.index = hnswlib.Index(space="ip", dim=max(flat.dim, 1))
+        self.index.load_index(path or os.path.join(flat.path, HNSW_FILE), max_elements=max(flat.count, 1))
+        self.set_ef(ef_search)
+
+    def set_ef(self, ef_search: int):
+        """
+        Đổi ef của cả index: chỉ gọi lúc load hoặc khi không có search song song (ann_benchmark.py),
+        không gọi từ request thread. k > ef thì hnswlib tự search với ef = k.
+        """
+        self.ef_search = ef_search
+        self.index.set_ef(ef_search)
+
+    def search(self, query_embeddings, k: int):
+        if not self.flat.count or not len(query_embeddings):
+            return [[] for _ in query_embeddings], {}
+        k = min(k, self.flat.count)
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        # Request đã chạy trong thread pool -> mỗi search 1 thread, không mở thêm thread của hnswlib
+        labels, _ = self.index.knn_query(queries, k=k, num_threads=1)
+
+        rows = self.flat.rows(np.unique(labels))
+        ids_by_row = {row: cid for cid, (_, _, _, row) in rows.items()}
+        ids_per_query = [[ids_by_row[row] for row in query_labels] for query_labels in labels.tolist()]
+        return ids_per_query, {cid: value[:3] for cid, value in rows.items()}
+
+    def get(self, ids) -> dict:
+        return self.flat.get(ids)
+
+
+_indexes = {}  # flat path -> HnswIndex
+_indexes_lock = threading.Lock()
+
+
+def get_ann_index(persist_directory: str):
+    """
+    HnswIndex của version flat index hiện tại.
+    Chưa có hnsw.bin (hoặc thiếu hnswlib) thì trả về chính FlatIndex (exact search), None nếu chưa export.
+    """
+    flat = get_flat_index(persist_directory)
+    if flat is None or hnswlib is None or not os.path.exists(os.path.join(flat.path, HNSW_FILE)):
+        return flat
+    with _indexes_lock:
+        index = _indexes.get(flat.path)
+        if index is None:
+            _indexes.clear()  # version cũ không dùng nữa
+            index = _indexes[flat.path] = HnswIndex(flat)
+        return index
@@ -1,17 +1,50 @@
+from startup import startup_report, warm_up
 import os
+import json
+import uuid
+import shutil
+import asyncio
+import threading
 from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi.responses import RedirectResponse, JSONResponse, StreamingResponse, Response
 from typing import List
 from fastapi import UploadFile, File, HTTPException
-from bot import ask_question
-from embed import build_dataset_from_drive_file, embed_local_file
-from Models import Query, IngestionList, Reaction
+from bot import (
+    ask_question,
+    stream_question,
+    prepare_contexts,
+    answer_from_context,
+    backfill_confidence,
+    warmup_vector_backend,
+    get_bot_lexical_index,
+    get_llm,
+)
+from embed import (
+    file_content_hash,
+    shutdown_ingest_executor,
+)
+from jobs import ingestion_worker, INGEST_SPOOL_DIR
+from Models import Query, QueryBatch, IngestionList, Reaction
+from cache import answer_cache
+from embedder import warmup as warmup_embedding_model
+from pool import (
+    query_pool,
+    background_pool,
+    PoolBusyError,
+    QUERY_BATCH_CONCURRENCY,
+    QUERY_BATCH_MAX_SIZE,
+    QUERY_BATCH_RETRY_DELAY,
+)
+from reaction_buffer import reaction_buffer
+from log_writer import query_log_writer
+from telemetry import rag_stage, rag_request, render_metrics
 from Database import (
-    log_query,
-    update_reaction_added,
-    update_reaction_removed,
+    close_db_connections,
     should_ingest,
-    insert_ingestion_log,
+    enqueue_ingestion_job,
+    get_pending_ingestion_job,
+    get_ingestion_job,
+    list_ingestion_jobs,
 )
 from smtp import SendEmail
 from metrics import (
@@ -28,10 +61,39 @@ from report import (
     GetWeekRange,
 )
 
+startup_report.mark("imports")
 
 app = FastAPI(title="Windows Troubleshooting QA API")
 
 
+@app.on_event("startup")
+def startup():
+    ingestion_worker.start()
+    query_log_writer.start()
+    reaction_buffer.start()
+    startup_report.mark("background_workers")
+    # Model / Chroma / Gemini load ở background: metrics, report... phục vụ được ngay,
+    # /ready báo khi phần RAG sẵn sàng
+    warm_up([
+        ("embedding_model", warmup_embedding_model),
+        ("vector_index", warmup_vector_backend),
+        ("lexical_index", get_bot_lexical_index),
+        ("llm", get_llm),
+    ])
+
+
+@app.on_event("shutdown")
+def shutdown():
+    query_pool.shutdown()
+    background_pool.shutdown()
+    ingestion_worker.stop()
+    # log trước reaction để reaction còn chờ tìm thấy dòng của nó
+    query_log_writer.stop()
+    reaction_buffer.stop()
+    shutdown_ingest_executor()
+    close_db_connections()
+
+
 # ------------------------------------------------------
 # Root
 # ------------------------------------------------------
@@ -40,6 +102,23 @@ async def root():
     return RedirectResponse(url="/docs")
 
 
+@app.get("/ready")
+def ready():
+    """Readiness probe + thời gian từng bước khởi động."""
+    report = startup_report.snapshot()
+    return JSONResponse(status_code=200 if report["ready"] else 503, content=report)
+
+
+@app.get("/metrics")
+def prometheus_metrics():
+    """Prometheus scrape endpoint (latency histogram theo stage, cache, ingestion, sqlite)."""
+    rendered = render_metrics()
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Telemetry is disabled.")
+    body, content_type = rendered
+    return Response(content=body, media_type=content_type)
+
+
 # ------------------------------------------------------
 # Query endpoints
 # ------------------------------------------------------
@@ -47,13 +126,12 @@ async def root():
 def ask_test(query: str):
     try:
         answer = ask_question(query)
-        log_id = log_query(
-            "test_qid",
-            "test_user",
-            "test_channel",
-            query,
-            answer["answer"],
-            answer["final_confidence"],
+        if "error" in answer:
+            raise RuntimeError(answer["error"])
+        # Ghi log qua log_answer để mode background vẫn được backfill confidence
+        log_id = log_answer(
+            Query(question_id="test_qid", user_id="test_user", channel_id="test_channel", question=query),
+            answer,
         )
         return {
             "log_id": log_id,
@@ -65,11 +143,16 @@ def ask_test(query: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.post("/query")
-async def query_endpoint(query: Query):
-    try:
-        answer = ask_question(query.question)
-        log_id = log_query(
+def answer_and_log(query: Query):
+    """Chạy trong query_pool: RAG pipeline + ghi log đều là code sync."""
+    answer = ask_question(query.question)
+    return answer, log_answer(query, answer)
+
+
+def log_answer(query: Query, answer: dict) -> int:
+    """Ghi log (async) và đẩy việc chấm LLM confidence ra background nếu còn pending."""
+    with rag_stage("log"):
+        log_id = query_log_writer.log(
             query.question_id,
             query.user_id,
             query.channel_id,
@@ -77,98 +160,276 @@ async def query_endpoint(query: Query):
             answer["answer"],
             answer["final_confidence"],
         )
+    if answer.get("confidence_pending"):
+        try:
+            background_pool.submit(backfill_log_confidence, log_id, query.question, answer)
+        except PoolBusyError:
+            print(f"Background pool full, keeping similarity-only confidence for log {log_id}.")
+    return log_id
+
+
+def backfill_log_confidence(log_id: int, question: str, answer: dict):
+    query_log_writer.update_confidence(log_id, backfill_confidence(question, answer))
+
+
+@app.post("/query")
+async def query_endpoint(query: Query):
+    try:
+        with rag_request("query"):
+            answer, log_id = await query_pool.run(answer_and_log, query)
         return {
             "log_id": log_id,
             "question": query.question,
             "answer": answer["answer"],
             "similarity_confidence": answer["final_confidence"],
         }
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def stream_and_log(query: Query, emit, cancelled: threading.Event):
+    """Chạy trong query_pool: đẩy từng event của stream_question ra emit, log khi có kết quả cuối."""
+    with rag_request("query_stream"):
+        for event in stream_question(query.question):
+            if cancelled.is_set():
+                return  # client đã ngắt, không cần sinh tiếp
+            if event["type"] != "final":
+                emit(event)
+                continue
+
+            log_id = log_answer(query, event)
+            # cache_key là câu hỏi (đã normalize) của entry cache gốc, không trả cho client
+            final = {k: v for k, v in event.items() if k not in ("answer", "cache_key")}
+            emit({**final, "log_id": log_id, "question": query.question})
+
+
+@app.post("/query/stream")
+async def query_stream_endpoint(query: Query):
+    """
+    Như /query nhưng trả NDJSON: mỗi dòng 1 event token, dòng cuối là event "final"
+    chứa log_id + confidence (hoặc event "error").
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    cancelled = threading.Event()
+    end = object()
+
+    def emit(event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def on_done(future):
+        if future.exception() is not None:
+            emit({"type": "error", "error": str(future.exception())})
+        emit(end)
+
+    try:
+        future = query_pool.submit(stream_and_log, query, emit, cancelled)
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    future.add_done_callback(on_done)
+
+    async def body():
+        try:
+            while True:
+                event = await events.get()
+                if event is end:
+                    break
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        finally:
+            cancelled.set()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+def answer_prepared_and_log(query: Query, context):
+    """Chạy trong query_pool: phần LLM + log của 1 câu trong /query/batch."""
+    with rag_request("query_batch_item"):
+        answer = answer_from_context(query.question, context)
+        return answer, log_answer(query, answer)
+
+
+@app.post("/query/batch")
+async def query_batch_endpoint(batch: QueryBatch):
+    """
+    Trả lời nhiều câu hỏi 1 lần (vd. replay các câu bị escalate sau khi ingest tài liệu mới).
+    Embedding + Chroma search chạy chung cho cả batch, LLM chạy tối đa QUERY_BATCH_CONCURRENCY câu
+    song song. Kết quả trả NDJSON, mỗi dòng 1 câu theo thứ tự câu nào xong trước.
+    """
+    queries = batch.queries
+    if len(queries) > QUERY_BATCH_MAX_SIZE:
+        raise HTTPException(
+            status_code=400, detail=f"At most {QUERY_BATCH_MAX_SIZE} questions per batch."
+        )
+    try:
+        contexts = await query_pool.run(prepare_contexts, [q.question for q in queries])
+    except PoolBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
+        # embed / retrieval lỗi trước khi bắt đầu stream -> trả lỗi giống /query
         raise HTTPException(status_code=500, detail=str(e))
 
+    semaphore = asyncio.Semaphore(QUERY_BATCH_CONCURRENCY)
+
+    async def run_one(index: int):
+        query = queries[index]
+        async with semaphore:
+            while True:
+                try:
+                    answer, log_id = await query_pool.run(
+                        answer_prepared_and_log, query, contexts[index]
+                    )
+                    break
+                except PoolBusyError:
+                    # Nhường chỗ cho /query của user, thử lại sau
+                    await asyncio.sleep(QUERY_BATCH_RETRY_DELAY)
+                except Exception as e:
+                    return {"index": index, "question_id": query.question_id, "error": str(e)}
+        return {
+            "index": index,
+            "question_id": query.question_id,
+            "log_id": log_id,
+            "question": query.question,
+            "answer": answer["answer"],
+            "similarity_confidence": answer["final_confidence"],
+        }
+
+    async def body():
+        tasks = [asyncio.create_task(run_one(i)) for i in range(len(queries))]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task, ensure_ascii=False) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
 
 # ------------------------------------------------------
 # Ingestion endpoints
 # ------------------------------------------------------
 @app.post("/ingest_drive")
-async def ingest_drive(payload: IngestionList):
+def ingest_drive(payload: IngestionList):
+    """Enqueue job ingest cho các file Drive có thay đổi, trả về job_id để poll."""
     try:
+        jobs = []
         for document in payload.documents:
-            if should_ingest(
-                document.document_id, document.last_modified
-            ):
-                print(f"Starting ingestion for {document.document_name}...")
-                build_dataset_from_drive_file(
-                    document.document_id, document.document_name
-                )
-                insert_ingestion_log(
-                    document.source,
-                    document.document_id,
-                    document.document_type,
-                    document.document_name,
-                    "success",
-                    document.last_modified,
-                )
-            else:
+            # Chỉ so last_modified ở đây; checksum (gọi Drive API) được so trong job
+            if not should_ingest(document.document_id, document.last_modified):
                 print(
                     f"Skipping ingestion for {document.document_name} (up-to-date)."
                 )
+                jobs.append({"document_name": document.document_name, "job_id": None, "status": "skipped"})
+                continue
+
+            job_id, created = enqueue_ingestion_job(
+                document.source,
+                document.document_id,
+                document.document_type,
+                document.document_name,
+                document.last_modified,
+                payload={
+                    "kind": "drive",
+                    "file_id": document.document_id,
+                    "file_name": document.document_name,
+                },
+            )
+            if created:
+                print(f"Queued ingestion job {job_id} for {document.document_name}.")
+            jobs.append({"document_name": document.document_name, "job_id": job_id, "status": "queued"})
 
-        return {"status": "success", "message": "Ingestion process completed."}
+        ingestion_worker.notify()
+        return {"status": "success", "message": "Ingestion jobs queued.", "jobs": jobs}
     except Exception as e:
         return {"status": "failed", "message": str(e)}
 
 
-
-
 @app.post("/ingest_local")
 async def ingest_local(files: List[UploadFile] = File(...)):
+    """Lưu file upload vào spool dir và enqueue job ingest, trả về job_id để poll."""
     results = []
     for file in files:
-        temp_path = f"temp_{file.filename}"
+        document_id = f"local:{file.filename}"
+        spool_dir = os.path.join(INGEST_SPOOL_DIR, uuid.uuid4().hex)
+        spool_path = os.path.join(spool_dir, os.path.basename(file.filename))
+        queued = False
         try:
-            with open(temp_path, "wb") as f:
+            pending_id = get_pending_ingestion_job(document_id)
+            if pending_id:
+                results.append({
+                    "file": file.filename,
+                    "status": "queued",
+                    "job_id": pending_id,
+                    "message": f"{file.filename} is already queued."
+                })
+                continue
+
+            os.makedirs(spool_dir, exist_ok=True)
+            with open(spool_path, "wb") as f:
                 f.write(await file.read())
 
-            embed_local_file(temp_path)
-
-            insert_ingestion_log(
+            content_hash = file_content_hash(spool_path)
+            if not should_ingest(document_id, None, content_hash):
+                results.append({
+                    "file": file.filename,
+                    "status": "skipped",
+                    "job_id": None,
+                    "message": f"{file.filename} is already up-to-date."
+                })
+                continue
+
+            job_id, queued = enqueue_ingestion_job(
                 source="local_upload",
-                document_id="N/A",
+                document_id=document_id,
                 document_type=file.content_type or "unknown",
                 document_name=file.filename,
-                status="success",
-                last_modified=None
+                last_modified=None,
+                payload={"kind": "local", "path": spool_path},
+                content_hash=content_hash,
             )
-
             results.append({
                 "file": file.filename,
-                "status": "success",
-                "message": f"{file.filename} ingested successfully."
+                "status": "queued",
+                "job_id": job_id,
+                "message": f"{file.filename} queued for ingestion." if queued
+                           else f"{file.filename} is already queued."
             })
 
         except Exception as e:
-            insert_ingestion_log(
-                source="local_upload",
-                document_id="N/A",
-                document_type=file.content_type or "unknown",
-                document_name=file.filename,
-                status="failed",
-                last_modified=None
-            )
             results.append({
                 "file": file.filename,
                 "status": "failed",
+                "job_id": None,
                 "message": str(e)
             })
 
         finally:
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
+            # File đã enqueue thì worker sẽ xoá sau khi ingest xong
+            if not queued:
+                shutil.rmtree(spool_dir, ignore_errors=True)
 
+    ingestion_worker.notify()
     return {"results": results}
 
 
+@app.get("/ingest-jobs")
+def get_ingest_jobs(limit: int = 50, status: str = None):
+    try:
+        return {"status": "success", "data": list_ingestion_jobs(limit, status)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/ingest-jobs/{job_id}")
+def get_ingest_job(job_id: int):
+    job = get_ingestion_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return {"status": "success", "job": job}
+
+
 # ------------------------------------------------------
 # Feedback & Reactions
 # ------------------------------------------------------
@@ -180,16 +441,12 @@ async def reaction_received(reaction: Reaction):
         if reaction.reaction_name not in ["+1", "-1"]:
             raise HTTPException(status_code=400, detail="Invalid reaction name.")
 
-        if reaction.reaction_type == "reaction_added":
-            if reaction.reaction_name == "-1":
-                update_reaction_added(reaction.question_id, thumbs_up= False, thumbs_down= True)
-            elif reaction.reaction_name == "+1":
-                update_reaction_added(reaction.question_id, thumbs_up= True, thumbs_down= False)
-        else:
-            if reaction.reaction_name == "-1":
-                update_reaction_removed(reaction.question_id, thumbs_up= False, thumbs_down= True)
-            elif reaction.reaction_name == "+1":
-                update_reaction_removed(reaction.question_id, thumbs_up= True, thumbs_down=False)
+        # Ghi qua buffer, flush theo batch ở background
+        sign = 1 if reaction.reaction_type == "reaction_added" else -1
+        if reaction.reaction_name == "-1":
+            reaction_buffer.add(reaction.question_id, thumbs_up=0, thumbs_down=sign)
+        elif reaction.reaction_name == "+1":
+            reaction_buffer.add(reaction.question_id, thumbs_up=sign, thumbs_down=0)
 
         return {
             "status": "success",
@@ -229,9 +486,12 @@ def send_email(reportType: str):
 # Metrics & Analytics
 # ------------------------------------------------------
 @app.get("/get-metrics")
-async def get_metrics():
+def get_metrics(page: int = 1, page_size: int = 50):
     try:
-        today_count, week_count, month_count, ai_answered, escalated, escalated_table = GetMetrics()
+        page = max(page, 1)
+        page_size = min(max(page_size, 1), 500)
+        (today_count, week_count, month_count, ai_answered, escalated,
+         escalated_table, page) = GetMetrics(page, page_size)
         return {
             "status": "success",
             "metrics": {
@@ -241,12 +501,19 @@ async def get_metrics():
                 "ai_answered": ai_answered,
                 "escalated": escalated,
                 "escalated_table": escalated_table,
+                "page": page,
+                "page_size": page_size,
             },
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/get-answer-cache-stats")
+async def get_answer_cache_stats():
+    return {"status": "success", "stats": answer_cache.stats()}
+
+
 @app.get("/get-negative-feedback-trend")
 async def get_negative_feedback_trend():
     try:
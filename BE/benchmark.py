@@ -0,0 +1,296 @@
+"""
+Benchmark + regression cho RAG pipeline.
+
+Ingest corpus fixture (process_with_unstructured -> embed_dataset) vào 1 Chroma tạm,
+replay bộ câu hỏi với LLM giả lập và ghi kết quả ra JSON để so sánh giữa các commit
+(chunking, embedding model, retriever, ...):
+- latency từng stage (embed, search, generate, confidence): mean / p50 / p90 / p95 / p99 / max
+- throughput end-to-end của ask_question (có thể chạy song song)
+- bộ nhớ: tracemalloc peak khi trả lời + max RSS
+- recall@k và MRR theo expected_source của từng câu hỏi
+
+Chạy:
+    python benchmark.py
+    python benchmark.py --corpus <thư mục> --questions <file.jsonl> --concurrency 4 --llm-latency 300
+    RETRIEVER_MODE=dense python benchmark.py --output bench/results/dense.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import tracemalloc
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+BENCH_DIR = Path(__file__).parent / "bench"
+PERCENTILES = (50, 90, 95, 99)
+
+
+# -----------------------------
+# Stub LLM
+# -----------------------------
+class StubMessage:
+    def __init__(self, content: str):
+        self.content = content
+
+
+class StubLLM:
+    """
+    Thay cho ChatGoogleGenerativeAI: không gọi mạng, trả lời sau `latency` giây
+    để số đo phản ánh phần pipeline của mình chứ không phải Gemini.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+
+    def invoke(self, prompt: str):
+        if self.latency:
+            time.sleep(self.latency)
+        if "Reply with only a number" in prompt:
+            return StubMessage("80")
+        # "Answer" = đoạn đầu của context, đủ để đo kích thước output
+        context = prompt.split("Context:", 1)[-1]
+        return StubMessage(context.strip()[:500])
+
+    def stream(self, prompt: str):
+        for word in self.invoke(prompt).content.split(" "):
+            yield StubMessage(word + " ")
+
+    def with_structured_output(self, schema):
+        llm = self
+
+        class Structured:
+            def invoke(self, prompt):
+                return schema(answer=llm.invoke(prompt).content, confidence=80.0)
+
+        return Structured()
+
+
+# -----------------------------
+# Helpers
+# -----------------------------
+def summarize(samples: list) -> dict:
+    """Thống kê latency (ms)."""
+    if not samples:
+        return {"count": 0}
+    ms = np.asarray(samples, dtype=np.float64) * 1000
+    summary = {"count": len(samples), "mean_ms": round(float(ms.mean()), 3)}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(float(np.percentile(ms, p)), 3)
+    summary["max_ms"] = round(float(ms.max()), 3)
+    return summary
+
+
+def load_questions(path: Path) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def max_rss_mb(who=resource.RUSAGE_SELF) -> float:
+    # Linux trả KB, macOS trả byte
+    rss = resource.getrusage(who).ru_maxrss
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+# -----------------------------
+# Phases
+# -----------------------------
+def run_ingest(corpus_dir: Path, persist_directory: str) -> dict:
+    from embed import iter_chunks, embed_dataset, shutdown_ingest_executor
+
+    paths = sorted(str(p) for p in corpus_dir.iterdir() if p.is_file())
+    start = time.perf_counter()
+    chunks = embed_dataset(iter_chunks(paths), persist_directory=persist_directory)
+    elapsed = time.perf_counter() - start
+    # RUSAGE_CHILDREN chỉ tính worker đã kết thúc -> tắt process pool ingest rồi mới đọc
+    shutdown_ingest_executor()
+    return {
+        "files": len(paths),
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "chunks_per_sec": round(chunks / elapsed, 2) if elapsed else None,
+        "workers_max_rss_mb": max_rss_mb(resource.RUSAGE_CHILDREN),
+    }
+
+
+def run_stages(bot, questions: list, k: int) -> tuple:
+    """Đo từng stage của 1 câu hỏi + recall@k / MRR."""
+    timings = {"embed": [], "search": [], "generate": [], "confidence": [], "total": []}
+    hits, reciprocal_ranks, misses = 0, [], []
+
+    for item in questions:
+        query = item["question"]
+        t0 = time.perf_counter()
+        query_emb = bot.get_embedding_model().embed_query(query)
+        t1 = time.perf_counter()
+        docs, _ = bot.retrieve_with_scores(query_emb, k, query=query)
+        t2 = time.perf_counter()
+        answer = bot.generate_answer(query, docs)
+        t3 = time.perf_counter()
+        bot.score_llm_confidence(query, answer)
+        t4 = time.perf_counter()
+
+        timings["embed"].append(t1 - t0)
+        timings["search"].append(t2 - t1)
+        timings["generate"].append(t3 - t2)
+        timings["confidence"].append(t4 - t3)
+        timings["total"].append(t4 - t0)
+
+        sources = [os.path.basename(doc.metadata.get("source", "")) for doc in docs]
+        expected = item.get("expected_source")
+        if expected in sources:
+            hits += 1
+            reciprocal_ranks.append(1 / (sources.index(expected) + 1))
+        else:
+            reciprocal_ranks.append(0.0)
+            misses.append({"question": query, "expected_source": expected, "retrieved": sources})
+
+    retrieval = {
+        "k": k,
+        f"recall_at_{k}": round(hits / len(questions), 4) if questions else None,
+        "mrr": round(float(np.mean(reciprocal_ranks)), 4) if questions else None,
+        "misses": misses,
+    }
+    return {name: summarize(samples) for name, samples in timings.items()}, retrieval
+
+
+def run_throughput(bot, questions: list, concurrency: int, repeat: int) -> dict:
+    """ask_question end-to-end (cache tắt), chạy song song `concurrency` câu."""
+    queries = [item["question"] for item in questions] * repeat
+    latencies = []
+
+    def timed(query):
+        start = time.perf_counter()
+        result = bot.ask_question(query, confidence_mode="separate")
+        latencies.append(time.perf_counter() - start)
+        return result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, queries))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "concurrency": concurrency,
+        "queries": len(queries),
+        "errors": sum(1 for r in results if "error" in r),
+        "seconds": round(elapsed, 3),
+        "throughput_qps": round(len(queries) / elapsed, 2) if elapsed else None,
+        "latency": summarize(latencies),
+    }
+
+
+def run_memory(bot, questions: list) -> dict:
+    tracemalloc.start()
+    try:
+        for item in questions:
+            bot.ask_question(item["question"], confidence_mode="separate")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "query_tracemalloc_peak_mb": round(peak / (1024 * 1024), 3),
+        "max_rss_mb": max_rss_mb(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the RAG pipeline.")
+    parser.add_argument("--corpus", type=Path, default=BENCH_DIR / "corpus")
+    parser.add_argument("--questions", type=Path, default=BENCH_DIR / "questions.jsonl")
+    parser.add_argument("--output", type=Path, default=None)
+    parser.add_argument("--k", type=int, default=None, help="top-k (mặc định TOP_K của bot)")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="ms mỗi lần gọi stub LLM")
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3, help="số lần replay bộ câu hỏi khi đo throughput")
+    parser.add_argument("--keep-db", action="store_true", help="giữ lại Chroma tạm sau khi chạy")
+    args = parser.parse_args()
+
+    persist_directory = tempfile.mkdtemp(prefix="bench_chroma_")
+    # bot.py đọc CHROMA_DB_PATH lúc import -> phải set trước
+    os.environ["CHROMA_DB_PATH"] = persist_directory
+
+    from embed import new_splitter, shutdown_ingest_executor
+    from embedder import EMBEDDING_MODEL, warmup
+    from cache import AnswerCache
+
+    try:
+        warmup()
+        ingest = run_ingest(args.corpus, persist_directory)
+
+        import bot
+        stub_llm = StubLLM(args.llm_latency / 1000)
+        bot.get_llm = lambda: stub_llm
+        # Tắt cache để mỗi lần replay đều chạy hết pipeline
+        bot.answer_cache = AnswerCache(max_size=0, ttl=0, similarity_threshold=2.0)
+
+        questions = load_questions(args.questions)
+        k = args.k or bot.TOP_K
+        stages, retrieval = run_stages(bot, questions, k)
+        throughput = run_throughput(bot, questions, args.concurrency, args.repeat)
+        memory = run_memory(bot, questions)
+
+        splitter = new_splitter()
+        commit = git_commit()
+        report = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "git_commit": commit,
+            "config": {
+                "corpus": str(args.corpus),
+                "questions": len(questions),
+                "embedding_model": EMBEDDING_MODEL,
+                "retriever_mode": bot.RETRIEVER_MODE,
+                "top_k": k,
+                "hybrid_candidates": bot.HYBRID_CANDIDATES,
+                "chunk_size": splitter._chunk_size,
+                "chunk_overlap": splitter._chunk_overlap,
+                "llm_latency_ms": args.llm_latency,
+            },
+            "ingest": ingest,
+            "stages": stages,
+            "end_to_end": throughput,
+            "memory": {**memory, "ingest_workers_max_rss_mb": ingest["workers_max_rss_mb"]},
+            "retrieval": retrieval,
+        }
+    finally:
+        shutdown_ingest_executor()
+        if not args.keep_db:
+            shutil.rmtree(persist_directory, ignore_errors=True)
+
+    output = args.output or BENCH_DIR / "results" / (
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}_{commit}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(json.dumps({
+        "ingest": ingest,
+        "stages_p50_ms": {name: s.get("p50_ms") for name, s in stages.items()},
+        "throughput_qps": throughput["throughput_qps"],
+        f"recall_at_{k}": retrieval[f"recall_at_{k}"],
+        "mrr": retrieval["mrr"],
+        "memory": memory,
+    }, indent=2))
+    print(f"Saved benchmark results → {output}")
+
+
+if __name__ == "__main__":
+    main()
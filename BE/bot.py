@@ -1,32 +1,119 @@
 import os
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings 
+import time
+import threading
+import numpy as np
 from langchain.prompts import PromptTemplate 
-from langchain.chains import RetrievalQA 
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain.schema import Document
+from pydantic import BaseModel, Field
+from cache import answer_cache
+from embedder import get_embedding_model
+from lexical import get_lexical_index
+from flat_index import get_flat_index
+from ann_index import get_ann_index
+from telemetry import rag_stage, observe_rag_stage, count_cache_lookup
 from dotenv import load_dotenv
 
 load_dotenv()
 # Load data
 persist_dir = os.getenv("CHROMA_DB_PATH")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+TOP_K = 5
+# separate   -> gọi Gemini lần 2 để chấm confidence (mặc định)
+# inline     -> answer + confidence trả về trong cùng 1 structured response
+# background -> trả answer ngay, confidence được chấm sau và backfill vào query_logs
+LLM_CONFIDENCE_MODE = os.getenv("LLM_CONFIDENCE_MODE", "separate")
+CONFIDENCE_MODES = ("separate", "inline", "background")
+if LLM_CONFIDENCE_MODE not in CONFIDENCE_MODES:
+    raise ValueError(
+        f"Invalid LLM_CONFIDENCE_MODE {LLM_CONFIDENCE_MODE!r}, expected one of {CONFIDENCE_MODES}"
+    )
+# dense  -> chỉ vector search trong Chroma
+# hybrid -> vector + BM25 (lexical.py), gộp bằng reciprocal rank fusion
+RETRIEVER_MODE = os.getenv("RETRIEVER_MODE", "hybrid")
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # số ứng viên lấy từ mỗi retriever
+RRF_K = int(os.getenv("RRF_K", "60"))
+LEXICAL_EMPTY_RECHECK_INTERVAL = 60  # giây giữa 2 lần kiểm tra lại BM25 index rỗng
+# chroma -> query thẳng Chroma
+# flat   -> matrix mmap export từ Chroma (flat_index.py), các worker dùng chung page cache
+# hnsw   -> ANN (ann_index.py) trên flat index, cho corpus lớn; chưa build thì exact trên flat
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
 
-embedding_model = HuggingFaceEmbeddings(
-    model_name= EMBEDDING_MODEL,
-    encode_kwargs={"normalize_embedding": True}) 
+# Chroma / BM25 index / Gemini client được tạo lần đầu dùng (hoặc lúc warmup ở startup),
+# import bot.py không load model hay mở DB
+_lock = threading.Lock()
+_vectordb = None
+_llm = None
+_lexical_ready = False
+_lexical_checked_at = None
 
-vectordb = Chroma(persist_directory=persist_dir, embedding_function=embedding_model) 
 
-# Retriever
-retriever = vectordb.as_retriever(search_kwargs={"k": 5}) 
+def get_vectordb():
+    global _vectordb
+    if _vectordb is None:
+        with _lock:
+            if _vectordb is None:
+                from langchain_community.vectorstores import Chroma
+                _vectordb = Chroma(persist_directory=persist_dir, embedding_function=get_embedding_model())
+    return _vectordb
 
-# LLM
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash", 
-    temperature=0,
-    google_api_key=os.getenv("GOOGLE_GEMINI_API_KEY"),
-    max_retries=1
-) 
+
+def get_bot_vector_index():
+    """
+    Index export (flat / hnsw) theo VECTOR_BACKEND, cùng interface search / get.
+    None -> dùng Chroma (VECTOR_BACKEND=chroma hoặc chưa export).
+    """
+    if not persist_dir or VECTOR_BACKEND not in ("flat", "hnsw"):
+        return None
+    if VECTOR_BACKEND == "hnsw":
+        return get_ann_index(persist_dir)
+    return get_flat_index(persist_dir)
+
+
+def warmup_vector_backend():
+    """Mở vector store sẽ dùng để serve (index export không cần mở Chroma)."""
+    index = get_bot_vector_index()
+    if index is None:
+        if VECTOR_BACKEND != "chroma":
+            print(f"{VECTOR_BACKEND} index not exported yet, falling back to Chroma.")
+        get_vectordb()
+    elif VECTOR_BACKEND == "hnsw" and not hasattr(index, "ef_search"):
+        print("HNSW index not available, using exact search on the flat index.")
+
+
+def get_bot_lexical_index():
+    """
+    BM25 index cho hybrid. None nếu index còn rỗng (store embed trước khi có lexical.py,
+    chưa chạy `python embed.py rebuild-lexical-index`) -> retrieve_many chỉ dùng dense.
+    """
+    global _lexical_ready, _lexical_checked_at
+    if not persist_dir:
+        return None
+    index = get_lexical_index(persist_dir)
+    if not _lexical_ready:
+        now = time.monotonic()
+        if _lexical_checked_at is not None and now - _lexical_checked_at < LEXICAL_EMPTY_RECHECK_INTERVAL:
+            return None
+        _lexical_checked_at = now
+        _lexical_ready = index.count() > 0
+        if not _lexical_ready:
+            print("Lexical index is empty, using dense retrieval. "
+                  "Run `python embed.py rebuild-lexical-index` to enable hybrid.")
+            return None
+    return index
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        with _lock:
+            if _llm is None:
+                from langchain_google_genai import ChatGoogleGenerativeAI
+                _llm = ChatGoogleGenerativeAI(
+                    model="gemini-2.5-flash", 
+                    temperature=0,
+                    google_api_key=os.getenv("GOOGLE_GEMINI_API_KEY"),
+                    max_retries=1
+                )
+    return _llm
 
 # Custom prompt
 prompt_template = PromptTemplate(
@@ -65,56 +152,297 @@ Question: {question}
 Answer:"""
 )
 
-qa_chain = RetrievalQA.from_chain_type( 
-    llm=llm, 
-    retriever=retriever, 
-    chain_type="stuff",
-    chain_type_kwargs={"prompt": prompt_template},
-    return_source_documents=True
-)
 
-def ask_question(query):
-    try:
-        result = qa_chain(query)  
-        answer = result["result"]
-        docs = result["source_documents"]
+# -----------------------------
+# Retrieval
+# -----------------------------
+def retrieve_with_scores(query_embedding, k=TOP_K, query=None):
+    """
+    Lấy top-k chunk cho 1 query embedding kèm cosine similarity.
+    Score được tính từ vector đã lưu trong Chroma nên không phải embed lại chunk.
+    Có query (text) và RETRIEVER_MODE=hybrid thì gộp thêm kết quả BM25.
 
-        # --- 1. Similarity Confidence ---
-        query_emb = embedding_model.embed_query(query)
-        doc_emb = embedding_model.embed_query(docs[0].page_content)
-        # cosine similarity
-        from sklearn.metrics.pairwise import cosine_similarity
-        sim_score = float(cosine_similarity([query_emb], [doc_emb])[0][0])
+    Return:
+        (docs, scores) -> docs theo thứ tự gần nhất trước, scores là cosine similarity tương ứng
+    """
+    return retrieve_many([query_embedding], k, None if query is None else [query])[0]
+
+
+def retrieve_many(query_embeddings, k=TOP_K, queries=None):
+    """Như retrieve_with_scores cho nhiều query trong 1 lần query Chroma. Return list (docs, scores)."""
+    if not query_embeddings:
+        return []
+    lexical_index = get_bot_lexical_index() if RETRIEVER_MODE == "hybrid" else None
+    hybrid = queries is not None and lexical_index is not None
+    ids_per_query, rows = dense_search(query_embeddings, max(k, HYBRID_CANDIDATES) if hybrid else k)
+
+    results = []
+    for i, query_embedding in enumerate(query_embeddings):
+        dense_ids = ids_per_query[i]
+        ranked = dense_ids[:k]
+        if hybrid:
+            lexical_ids = lexical_index.search(queries[i], HYBRID_CANDIDATES)
+            ranked = reciprocal_rank_fusion([dense_ids, lexical_ids])[:k]
+            missing = [cid for cid in ranked if cid not in rows]
+            if missing:
+                # chunk chỉ BM25 tìm thấy: lấy text + vector đã lưu trong vector store
+                rows.update(fetch_rows(missing))
+                ranked = [cid for cid in ranked if cid in rows]
+
+        if not ranked:
+            results.append(([], []))
+            continue
+
+        docs = [
+            Document(page_content=rows[cid][0], metadata=rows[cid][1] or {})
+            for cid in ranked
+        ]
+        # Similarity confidence luôn là cosine thật của chunk (kể cả chunk do BM25 đưa lên)
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        doc_vecs = np.asarray([rows[cid][2] for cid in ranked], dtype=np.float32)
+        norms = np.linalg.norm(doc_vecs, axis=1) * np.linalg.norm(query_vec)
+        scores = (doc_vecs @ query_vec) / np.maximum(norms, 1e-12)
+        results.append((docs, scores.tolist()))
+    return results
 
-        # scale 
-        sim_conf = round(sim_score * 100, 2)
 
-        # --- 2. LLM Confidence ---
-        conf_prompt = f"""
+def dense_search(query_embeddings, n):
+    """
+    Top-n theo vector cho nhiều query (Chroma, flat hoặc hnsw tuỳ VECTOR_BACKEND).
+    Return (ids_per_query, rows) với rows: chunk_id -> (document, metadata, vector)
+    """
+    index = get_bot_vector_index()
+    if index is not None:
+        return index.search(query_embeddings, n)
+
+    result = get_vectordb()._collection.query(
+        query_embeddings=[list(emb) for emb in query_embeddings],
+        n_results=n,
+        include=["documents", "metadatas", "embeddings"],
+    )
+    rows = {}
+    for i in range(len(query_embeddings)):
+        rows.update(zip(
+            result["ids"][i],
+            zip(result["documents"][i], result["metadatas"][i], result["embeddings"][i]),
+        ))
+    return [list(ids) for ids in result["ids"]], rows
+
+
+def fetch_rows(ids):
+    """chunk_id -> (document, metadata, vector) cho các id cho trước."""
+    index = get_bot_vector_index()
+    if index is not None:
+        return index.get(ids)
+    extra = get_vectordb()._collection.get(ids=ids, include=["documents", "metadatas", "embeddings"])
+    return dict(zip(extra["ids"], zip(extra["documents"], extra["metadatas"], extra["embeddings"])))
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Gộp nhiều danh sách id đã xếp hạng: score = sum(1 / (k + rank)). Hoà điểm thì giữ thứ tự danh sách đầu."""
+    scores = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class AnswerWithConfidence(BaseModel):
+    answer: str = Field(description="The answer, following the required answer format.")
+    confidence: float = Field(
+        description="From 0 to 100, how confident you are that the answer fully matches the context and is correct."
+    )
+
+
+def build_prompt(query, docs):
+    """Stuff các chunk vào prompt (tương đương chain_type="stuff")."""
+    context = "\n\n".join(doc.page_content for doc in docs)
+    return prompt_template.format(context=context, question=query)
+
+
+def generate_answer(query, docs):
+    with rag_stage("generate"):
+        return get_llm().invoke(build_prompt(query, docs)).content
+
+
+def generate_answer_with_confidence(query, docs):
+    """1 lần gọi Gemini, trả về (answer, llm_confidence)."""
+    structured_llm = get_llm().with_structured_output(AnswerWithConfidence)
+    with rag_stage("generate"):
+        result = structured_llm.invoke(build_prompt(query, docs))
+    return result.answer, min(max(float(result.confidence), 0.0), 100.0)
+
+
+def score_llm_confidence(query, answer):
+    conf_prompt = f"""
         Question: {query}
         Answer: {answer}
 
         From 0 to 100, how confident are you that the answer fully matches the context and is correct?
         Reply with only a number (0-100).
         """
-        llm_conf = llm.invoke(conf_prompt).content.strip()
-        try:
-            llm_conf = float(llm_conf)
-        except:
-            llm_conf = 50.0  # fallback if LLM returns invalid number
-
-        # --- 3. Final Confidence (average of 2 sources) ---
-        final_conf = round((sim_conf + llm_conf) / 2, 2)
-
-        return {
-            "answer": answer,
-            "similarity_confidence": sim_conf,
-            "llm_confidence": llm_conf,
-            "final_confidence": final_conf
-        }
+    with rag_stage("confidence"):
+        llm_conf = get_llm().invoke(conf_prompt).content.strip()
+    try:
+        return float(llm_conf)
+    except:
+        return 50.0  # fallback if LLM returns invalid number
+
+
+def combine_confidence(sim_conf, llm_conf):
+    # Final Confidence (average of 2 sources)
+    return round((sim_conf + llm_conf) / 2, 2)
+
+
+def prepare_context(query):
+    """
+    Phần chung của ask_question / stream_question trước khi gọi LLM.
+
+    Return:
+        (cached, query_emb, docs, sim_conf) -> cached khác None thì dùng luôn, bỏ qua phần còn lại
+    """
+    return prepare_contexts([query])[0]
+
+
+def prepare_contexts(queries):
+    """
+    prepare_context cho nhiều câu hỏi: embed các câu chưa có trong cache bằng 1 lần
+    embed_documents (vectorized) và retrieve tất cả trong 1 lần query Chroma.
+    """
+    contexts = [None] * len(queries)
+    to_embed = []
+    for i, query in enumerate(queries):
+        cached = answer_cache.get(query)
+        if cached is not None:
+            count_cache_lookup("exact_hit")
+            contexts[i] = (cached, None, [], 0.0)
+        else:
+            to_embed.append(i)
+    if not to_embed:
+        return contexts
+
+    # Query chỉ embed 1 lần, dùng chung cho cache, retrieval và similarity confidence
+    embedding_model = get_embedding_model()
+    with rag_stage("embed"):
+        if len(to_embed) == 1:
+            embeddings = [embedding_model.embed_query(queries[to_embed[0]])]
+        else:
+            embeddings = embedding_model.embed_documents([queries[i] for i in to_embed])
+
+    to_retrieve = []
+    for i, query_emb in zip(to_embed, embeddings):
+        cached = answer_cache.get_similar(query_emb)
+        if cached is not None:
+            count_cache_lookup("semantic_hit")
+            contexts[i] = (cached, query_emb, [], 0.0)
+        else:
+            count_cache_lookup("miss")
+            to_retrieve.append((i, query_emb))
+
+    with rag_stage("retrieval"):
+        retrieved = retrieve_many(
+            [query_emb for _, query_emb in to_retrieve],
+            queries=[queries[i] for i, _ in to_retrieve],
+        )
+    for (i, query_emb), (docs, scores) in zip(to_retrieve, retrieved):
+        # --- 1. Similarity Confidence ---
+        # Sau RRF chunk đầu chưa chắc có cosine cao nhất -> lấy max
+        sim_score = max(scores) if scores else 0.0
+
+        # scale 
+        sim_conf = round(sim_score * 100, 2)
+        contexts[i] = (None, query_emb, docs, sim_conf)
+    return contexts
+
+
+def finish_answer(query, query_emb, answer, sim_conf, llm_conf):
+    # --- 3. Final Confidence ---
+    # background: tạm dùng similarity, điểm cuối được backfill sau khi chấm xong
+    final_conf = sim_conf if llm_conf is None else combine_confidence(sim_conf, llm_conf)
+
+    result = {
+        "answer": answer,
+        "similarity_confidence": sim_conf,
+        "llm_confidence": llm_conf,
+        "final_confidence": final_conf,
+        "confidence_pending": llm_conf is None,
+    }
+    answer_cache.put(query, query_emb, result)
+    return result
+
+
+def backfill_confidence(query, result):
+    """
+    Chấm LLM confidence cho kết quả còn confidence_pending (mode background) và cập nhật
+    entry trong answer cache, để cache hit sau đó không phải gọi Gemini chấm lại.
+    Semantic hit cập nhật entry gốc (cache_key) chứ không phải key của câu hỏi mới.
+    Return: final confidence
+    """
+    llm_conf = score_llm_confidence(query, result["answer"])
+    final_conf = combine_confidence(result["similarity_confidence"], llm_conf)
+    answer_cache.update(result.get("cache_key", query), result["answer"], {
+        "llm_confidence": llm_conf,
+        "final_confidence": final_conf,
+        "confidence_pending": False,
+    })
+    return final_conf
+
+
+def ask_question(query, confidence_mode=LLM_CONFIDENCE_MODE):
+    try:
+        return answer_from_context(query, prepare_context(query), confidence_mode)
     except Exception as e:
         return {"error": str(e)}
 
+
+def answer_from_context(query, context, confidence_mode=LLM_CONFIDENCE_MODE):
+    """Phần gọi LLM của ask_question, context lấy từ prepare_context / prepare_contexts."""
+    cached, query_emb, docs, sim_conf = context
+    if cached is not None:
+        return cached
+
+    # --- 2. Answer + LLM Confidence ---
+    if confidence_mode == "inline":
+        answer, llm_conf = generate_answer_with_confidence(query, docs)
+    else:
+        answer = generate_answer(query, docs)
+        llm_conf = score_llm_confidence(query, answer) if confidence_mode == "separate" else None
+
+    return finish_answer(query, query_emb, answer, sim_conf, llm_conf)
+
+
+def stream_question(query, confidence_mode=LLM_CONFIDENCE_MODE):
+    """
+    Như ask_question nhưng yield từng event:
+        {"type": "token", "text": ...}  -> token của answer ngay khi Gemini sinh ra
+        {"type": "final", ...}          -> confidence (cùng field với ask_question), luôn là event cuối
+        {"type": "error", "error": ...}
+    inline không stream được structured output nên được chấm như separate.
+    """
+    try:
+        start = time.perf_counter()
+        cached, query_emb, docs, sim_conf = prepare_context(query)
+        if cached is not None:
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "final", **cached}
+            return
+
+        parts = []
+        generate_start = time.perf_counter()
+        for chunk in get_llm().stream(build_prompt(query, docs)):
+            if chunk.content:
+                if not parts:
+                    observe_rag_stage("first_token", time.perf_counter() - start)
+                parts.append(chunk.content)
+                yield {"type": "token", "text": chunk.content}
+        observe_rag_stage("generate", time.perf_counter() - generate_start)
+        answer = "".join(parts)
+
+        llm_conf = score_llm_confidence(query, answer) if confidence_mode != "background" else None
+        yield {"type": "final", **finish_answer(query, query_emb, answer, sim_conf, llm_conf)}
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+
 if __name__ == "__main__":
     query = input("Enter question: ")
     result = ask_question(query)
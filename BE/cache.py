@@ -0,0 +1,149 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==== CONFIG ====
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "1024"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # giây
+# Cosine similarity tối thiểu để coi 2 câu hỏi là cùng 1 câu (semantic hit)
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.95"))
+
+
+def normalize_question(question: str) -> str:
+    """Chuẩn hoá câu hỏi làm key: lowercase, gộp khoảng trắng, bỏ dấu câu ở cuối."""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+
+class AnswerCache:
+    """
+    Cache câu trả lời của ask_question.
+    - Exact hit: theo câu hỏi đã normalize
+    - Semantic hit: câu hỏi gần nhất có cosine >= similarity_threshold
+    - Eviction: TTL + LRU (tối đa max_size entry)
+    """
+
+    def __init__(self, max_size: int, ttl: float, similarity_threshold: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires_at, embedding, value)
+        self._matrix = None            # embedding của các entry, build lại khi cache đổi
+        self._matrix_keys = []
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, question: str):
+        """Exact lookup, không cần embedding."""
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(entry[2])
+
+    def get_similar(self, embedding):
+        """Semantic lookup theo query embedding. Gọi sau get() nên miss được đếm ở đây."""
+        if self.similarity_threshold > 1:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        query_vec = _unit(embedding)
+        with self._lock:
+            self._expire()
+            if not self._entries:
+                self.misses += 1
+                return None
+            if self._matrix is None:
+                self._matrix_keys = list(self._entries.keys())
+                self._matrix = np.stack([self._entries[k][1] for k in self._matrix_keys])
+
+            scores = self._matrix @ query_vec
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+
+            key = self._matrix_keys[best]
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+            return dict(self._entries[key][2])
+
+    def put(self, question: str, embedding, value: dict):
+        """Value được lưu kèm "cache_key" để semantic hit biết entry gốc (vd. update confidence)."""
+        key = normalize_question(question)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, _unit(embedding), {**value, "cache_key": key})
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            self._matrix = None
+
+    def update(self, question: str, answer: str, fields: dict) -> bool:
+        """
+        Cập nhật field của entry đang cache (giữ TTL / vị trí LRU), vd. confidence được backfill sau.
+        Chỉ cập nhật nếu entry vẫn là câu trả lời `answer` (không ghi đè entry mới sau khi clear).
+        question là câu đã cache hoặc "cache_key" của value trả về từ get / get_similar.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[2].get("answer") != answer:
+                return False
+            self._entries[key] = (entry[0], entry[1], {**entry[2], **fields})
+            return True
+
+    def clear(self):
+        """Invalidate toàn bộ cache (vd. khi có dữ liệu mới được ingest)."""
+        with self._lock:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.semantic_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "similarity_threshold": self.similarity_threshold,
+                "hits": self.hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.semantic_hits) / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _expire(self):
+        now = time.monotonic()
+        expired = [k for k, (expires_at, _, _) in self._entries.items() if expires_at < now]
+        for k in expired:
+            del self._entries[k]
+            self.evictions += 1
+        if expired:
+            self._matrix = None
+
+
+def _unit(embedding):
+    vec = np.asarray(embedding, dtype=np.float32)
+    return vec / max(float(np.linalg.norm(vec)), 1e-12)
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
@@ -1,18 +1,22 @@
 import os
+import io
+import sys
+import time
 import shutil
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from langchain_community.document_loaders import (
-    UnstructuredPDFLoader,
-    UnstructuredWordDocumentLoader,
-    UnstructuredExcelLoader,
-    UnstructuredPowerPointLoader,
-    UnstructuredFileLoader
-)
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from split import split_pdf_by_outline
+import hashlib
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from langchain.schema import Document
+from pypdf import PdfReader
+from split import split_pdf_by_outline, get_outline_ranges, iter_pdf_sections
+from cache import answer_cache
+from lexical import get_lexical_index
+from flat_index import export_flat_index, FLAT_INDEX_DIR
+from telemetry import ingest_stage, observe_ingest_stage, count_ingest_chunks
+from embedder import get_embedding_model
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -21,10 +25,23 @@ load_dotenv()
 CREDENTIALS_FILE = os.getenv("GOOGLE_CREDENTIALS")
 CHROMA_DB_PATH = os.getenv("CHROMA_DB_PATH")
 SCOPES = ["https://www.googleapis.com/auth/drive.readonly"]
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))  # số chunk / lần embed + upsert
+# Số process chạy Unstructured song song, 0 = theo số core
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or os.cpu_count() or 1
+# memory -> tách PDF theo outline trong RAM, files -> ghi từng section ra tmp_dir như cũ
+PDF_SPLIT_MODE = os.getenv("PDF_SPLIT_MODE", "memory")
+# Export flat index (flat_index.py) sau mỗi lần ingest có thay đổi; mặc định bật khi serve bằng flat
+FLAT_INDEX_EXPORT = os.getenv(
+    "FLAT_INDEX_EXPORT", "true" if os.getenv("VECTOR_BACKEND") in ("flat", "hnsw") else "false"
+).lower() in ("1", "true", "yes")
 
 
 # ===================== GOOGLE DRIVE AUTH =====================
 def init_gdrive():
+    # Import ở đây để app khởi động (và chạy được) khi chưa có Google credentials
+    from google.oauth2 import service_account
+    from googleapiclient.discovery import build
+
     creds = service_account.Credentials.from_service_account_file(
         CREDENTIALS_FILE, scopes=SCOPES
     )
@@ -32,6 +49,20 @@ def init_gdrive():
     return service
 
 
+_gdrive = threading.local()
+
+
+def get_gdrive_service():
+    """
+    Drive client tạo lần đầu cần gọi Drive, giữ lại theo thread
+    (httplib2 bên dưới không thread-safe nên không share giữa các thread).
+    """
+    service = getattr(_gdrive, "service", None)
+    if service is None:
+        service = _gdrive.service = init_gdrive()
+    return service
+
+
 def list_drive_files(service, mime_type="application/pdf"):
     """Lấy danh sách file PDF"""
     results = service.files().list(
@@ -42,6 +73,13 @@ def list_drive_files(service, mime_type="application/pdf"):
     return results.get("files", [])
 
 
+def get_drive_file_checksum(file_id, service=None):
+    """md5 nội dung file trên Drive (None với Google Docs/Sheets/Slides)."""
+    service = service or get_gdrive_service()
+    file_info = service.files().get(fileId=file_id, fields="md5Checksum").execute()
+    return file_info.get("md5Checksum")
+
+
 def download_from_gdrive_file(service, file_id, save_path: str):
     """
     Download file từ Google Drive.
@@ -78,9 +116,24 @@ def download_from_gdrive_file(service, file_id, save_path: str):
     return save_path
 
 # ===================== LOADER CHO NHIỀU ĐỊNH DẠNG =====================
+PLAIN_TEXT_EXTENSIONS = (".txt", ".md")
+
+
 def load_file(file_path: str):
+    from langchain_community.document_loaders import (
+        UnstructuredPDFLoader,
+        UnstructuredWordDocumentLoader,
+        UnstructuredExcelLoader,
+        UnstructuredPowerPointLoader,
+        UnstructuredFileLoader,
+        TextLoader,
+    )
+
     ext = os.path.splitext(file_path)[1].lower()
-    if ext == ".pdf":
+    if ext in PLAIN_TEXT_EXTENSIONS:
+        # text thuần: đọc thẳng file, không cần unstructured (partition_text cần model spaCy)
+        loader = TextLoader(file_path, encoding="utf-8")
+    elif ext == ".pdf":
         loader = UnstructuredPDFLoader(file_path)
     elif ext in [".docx", ".doc"]:
         loader = UnstructuredWordDocumentLoader(file_path)
@@ -89,22 +142,32 @@ def load_file(file_path: str):
     elif ext in [".pptx", ".ppt"]:
         loader = UnstructuredPowerPointLoader(file_path)
     else:
-        loader = UnstructuredFileLoader(file_path)  # txt, md, csv, v.v.
+        loader = UnstructuredFileLoader(file_path)  # csv, html, v.v.
     return loader.load()
 
 
 # ===================== RAG PIPELINE =====================
+def new_splitter():
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    return RecursiveCharacterTextSplitter(
+        chunk_size=1500,
+        chunk_overlap=350,
+        separators=["\n## ", "\n### ", "\n\n"]
+    )
+
+
+class PartitionError(RuntimeError):
+    """1 file / section không partition được; ingest phải dừng thay vì coi như tài liệu rỗng."""
+
+
 def process_with_unstructured(file_path: str):
     try:
         docs = load_file(file_path)
 
         all_chunks = []
 
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1500,
-            chunk_overlap=350,
-            separators=["\n## ", "\n### ", "\n\n"]
-        )
+        splitter = new_splitter()
 
         if not docs:
             print(f"⚠️ No text extracted from {file_path}, skipping.")
@@ -121,101 +184,369 @@ def process_with_unstructured(file_path: str):
 
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
-        return []
+        raise PartitionError(f"Failed to process {os.path.basename(file_path)}: {e}") from e
 
     print(f"Total chunks from {file_path}: {len(all_chunks)}")
     return all_chunks
 
 
-def embed_dataset(docs, persist_directory="db"):
-    embeddings = HuggingFaceEmbeddings(
-        model_name="sentence-transformers/all-MiniLM-L6-v2",
-        model_kwargs={"device": "cpu"}
+def process_pdf_section(section: dict, file_name: str):
+    """
+    Partition 1 section PDF (bytes trong RAM, từ split.iter_pdf_sections) rồi chia chunk.
+    Tên section và khoảng trang được gắn vào metadata của chunk.
+    """
+    from unstructured.partition.pdf import partition_pdf
+
+    label = f"{file_name} [{section['index']:02d} {section['title']}]"
+    try:
+        elements = partition_pdf(file=io.BytesIO(section["data"]))
+        text = "\n\n".join(str(el) for el in elements)
+        if not text.strip():
+            print(f"⚠️ No text extracted from {label}, skipping.")
+            return []
+
+        metadata = {
+            "source": file_name,
+            "filename": file_name,
+            "section_index": section["index"],
+            "section_title": section["title"],
+            "page_start": section["start_page"],
+            "page_end": section["end_page"],
+        }
+        chunks = new_splitter().split_documents([Document(page_content=text, metadata=metadata)])
+        print(f"{label} → {len(chunks)} chunks")
+        return chunks
+    except Exception as e:
+        print(f"Error processing {label}: {e}")
+        raise PartitionError(f"Failed to process {label}: {e}") from e
+
+
+def iter_chunks(items, process=process_with_unstructured, workers: int = INGEST_WORKERS):
+    """
+    load → split từng file/section, yield từng chunk (không gom cả tài liệu vào RAM)
+    - items: file path, hoặc section trong RAM (khi process=process_pdf_section)
+    - workers > 1: các item được partition song song trên process pool,
+      kết quả vẫn trả về đúng thứ tự đầu vào (thứ tự outline)
+    Item nào lỗi thì raise PartitionError (không bỏ qua), để embed_dataset không xoá chunk cũ.
+    """
+    if workers <= 1:
+        for item in items:
+            elapsed, chunks = run_timed(process, item)
+            observe_ingest_stage("partition", elapsed)
+            yield from chunks
+        return
+
+    executor = get_ingest_executor()
+    # Chỉ giữ tối đa 2 * workers section đang xử lý / chờ lấy để RAM không tăng theo tài liệu
+    window = min(workers, INGEST_WORKERS) * 2
+    items = iter(items)
+    pending = deque(
+        executor.submit(run_timed, process, item)
+        for _, item in zip(range(window), items)
+    )
+    try:
+        while pending:
+            elapsed, chunks = pending.popleft().result()
+            observe_ingest_stage("partition", elapsed)
+            next_item = next(items, None)
+            if next_item is not None:
+                pending.append(executor.submit(run_timed, process, next_item))
+            yield from chunks
+    finally:
+        # Lỗi / dừng giữa chừng: không partition tiếp các section còn chờ
+        for future in pending:
+            future.cancel()
+
+
+def run_timed(process, item):
+    """Chạy trong worker process: trả về (thời gian partition, chunks) để process cha ghi metric."""
+    start = time.perf_counter()
+    chunks = process(item)
+    return time.perf_counter() - start, chunks
+
+
+def timed_items(items, stage: str):
+    """Ghi thời gian sinh từng item (vd. tách section PDF lazy) vào ingest_stage_seconds."""
+    items = iter(items)
+    while True:
+        start = time.perf_counter()
+        item = next(items, _END)
+        if item is _END:
+            return
+        observe_ingest_stage(stage, time.perf_counter() - start)
+        yield item
+
+
+_END = object()
+
+
+def iter_document_chunks(file_path: str, split_dir: str, split_by_outline: bool = True):
+    """Chọn cách tách cho 1 tài liệu (theo outline nếu là PDF) và yield chunk."""
+    if not (file_path.lower().endswith(".pdf") and split_by_outline):
+        return iter_chunks([file_path])
+
+    if PDF_SPLIT_MODE == "files":
+        os.makedirs(split_dir, exist_ok=True)
+        with ingest_stage("split"):
+            sections = split_pdf_by_outline(file_path, split_dir)
+        return iter_chunks(sections or [file_path])
+
+    with ingest_stage("split"):
+        reader = PdfReader(file_path)
+        ranges = get_outline_ranges(reader)
+    if not ranges:
+        return iter_chunks([file_path])
+
+    process = partial(process_pdf_section, file_name=os.path.basename(file_path))
+    return iter_chunks(timed_items(iter_pdf_sections(reader, ranges), "split"), process)
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_ingest_executor():
+    """
+    Process pool dùng chung cho mọi lần ingest (tránh spawn lại worker mỗi file).
+    Dùng "spawn" vì process cha đã có thread (thread pool, torch) nên fork không an toàn.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=INGEST_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _executor
+
+
+def shutdown_ingest_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True, cancel_futures=True)
+            _executor = None
+
+
+def batched(iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def chunk_id(document_id: str, content: str) -> str:
+    """ID ổn định cho 1 chunk = hash(document_id + hash nội dung chunk)."""
+    content_hash = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    return hashlib.sha256(f"{document_id}\x00{content_hash}".encode("utf-8")).hexdigest()
+
+
+def file_content_hash(file_path: str) -> str:
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def legacy_source_paths(file_name: str) -> list:
+    """
+    Metadata "source" mà chunk của file_name có thể mang từ trước khi có chunk_id / document_id:
+    Drive tải về tmp/<tên>, upload local lưu temp_<tên>, section PDF ghi tên file.
+    """
+    return [file_name, os.path.join("tmp", file_name), f"temp_{file_name}"]
+
+
+def embed_dataset(
+    docs, persist_directory="db", batch_size: int = INGEST_BATCH_SIZE,
+    document_id: str = None, on_progress=None, legacy_sources: list = None
+):
+    """
+    Embed + upsert chunk vào ChromaDB theo từng batch cố định
+    - docs: list hoặc generator chunk (vd. iter_chunks)
+    - batch_size: số chunk mỗi batch; batch nào xong là đã được lưu
+    - document_id: nếu có, chỉ embed chunk mới/thay đổi của tài liệu này và
+      xoá chunk cũ không còn xuất hiện (re-ingest không sinh chunk trùng)
+    - on_progress: callback(số chunk đã xử lý), gọi sau mỗi batch
+    - legacy_sources: cùng document_id; chunk cũ (id ngẫu nhiên, chưa có document_id) có
+      "source" thuộc list này được coi là chunk cũ của tài liệu và bị xoá như chunk stale.
+      Không phân biệt được 2 file trùng tên ingest trước khi có document_id.
+    Return: tổng số chunk (không trùng) của tài liệu
+    """
+    from langchain_community.vectorstores import Chroma
+
+    vectordb = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=get_embedding_model()
     )
-    vectordb = Chroma.from_documents(
-        documents=docs,
-        embedding=embeddings,
-        persist_directory=persist_directory
+
+    # BM25 index cạnh Chroma, cùng chunk_id, add / delete song song với vector
+    lexical_index = get_lexical_index(persist_directory)
+
+    existing_ids = set()
+    if document_id:
+        existing_ids = set(vectordb.get(where={"document_id": document_id}, include=[])["ids"])
+        if legacy_sources:
+            legacy = vectordb.get(where={"source": {"$in": list(legacy_sources)}}, include=["metadatas"])
+            existing_ids.update(
+                cid for cid, meta in zip(legacy["ids"], legacy["metadatas"])
+                if not (meta or {}).get("document_id")
+            )
+
+    seen_ids = set()
+    added = 0
+    for batch in batched(docs, batch_size):
+        new_docs, new_ids = [], []
+        for doc in batch:
+            owner = document_id or doc.metadata.get("source") or doc.metadata.get("filename", "")
+            cid = chunk_id(owner, doc.page_content)
+            if cid in seen_ids:
+                continue
+            seen_ids.add(cid)
+            if cid in existing_ids:
+                continue
+            if document_id:
+                doc.metadata["document_id"] = document_id
+            new_docs.append(doc)
+            new_ids.append(cid)
+
+        if new_docs:
+            # embed gồm cả upsert vào Chroma (add_documents làm cả 2)
+            with ingest_stage("embed"):
+                vectordb.add_documents(new_docs, ids=new_ids)
+            with ingest_stage("persist"):
+                vectordb.persist()
+                lexical_index.add(
+                    new_ids,
+                    [doc.page_content for doc in new_docs],
+                    [doc.metadata.get("document_id") for doc in new_docs],
+                )
+            added += len(new_docs)
+        print(f"Processed {len(seen_ids)} chunks ({added} new) → {persist_directory}")
+        if on_progress:
+            on_progress(len(seen_ids))
+
+    # Chỉ xoá sau khi đã đọc hết tài liệu; partition lỗi (PartitionError) thoát khỏi vòng lặp
+    # trên nên không tới đây -> chunk cũ được giữ nguyên và job bị đánh dấu failed.
+    # Tài liệu giờ không còn chunk nào (seen_ids rỗng) thì xoá hết chunk cũ của nó.
+    stale_ids = list(existing_ids - seen_ids)
+    with ingest_stage("delete"):
+        for batch in batched(stale_ids, batch_size):
+            vectordb.delete(ids=batch)
+            lexical_index.delete(batch)
+        if stale_ids:
+            vectordb.persist()
+    count_ingest_chunks("added", added)
+    count_ingest_chunks("removed", len(stale_ids))
+    count_ingest_chunks("unchanged", len(seen_ids) - added)
+
+    print(
+        f"{document_id or persist_directory}: {added} added, {len(stale_ids)} removed, "
+        f"{len(seen_ids) - added} unchanged"
     )
-    vectordb.persist()
-    return vectordb
+    flat_missing = not os.path.exists(os.path.join(persist_directory, FLAT_INDEX_DIR))
+    if FLAT_INDEX_EXPORT and (added or stale_ids or flat_missing):
+        with ingest_stage("export"):
+            export_flat_index(vectordb._collection, persist_directory)
+    if added or stale_ids:
+        # Dữ liệu mới có thể thay đổi câu trả lời -> bỏ cache cũ
+        answer_cache.clear()
+    return len(seen_ids)
+
+
+def rebuild_lexical_index(persist_directory="chroma_db", batch_size: int = 1000):
+    """Dựng lại BM25 index từ các chunk đang có trong Chroma (store cũ chưa có index)."""
+    from langchain_community.vectorstores import Chroma
+
+    collection = Chroma(
+        persist_directory=persist_directory,
+        embedding_function=get_embedding_model()
+    )._collection
+    lexical_index = get_lexical_index(persist_directory)
+    lexical_index.clear()
+
+    offset = 0
+    while True:
+        page = collection.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+        if not page["ids"]:
+            break
+        lexical_index.add(
+            page["ids"],
+            page["documents"],
+            [(meta or {}).get("document_id") for meta in page["metadatas"]],
+        )
+        offset += len(page["ids"])
+    print(f"Lexical index rebuilt: {lexical_index.count()} chunks → {persist_directory}")
 
 
 def build_dataset_from_drive_file(
-    file_id, file_name, service=init_gdrive(),
-    persist_directory="chroma_db", tmp_dir="tmp"
+    file_id, file_name, service=None,
+    persist_directory="chroma_db", tmp_dir="tmp", on_progress=None
 ):
     """"Tải file từ Drive, tách nhỏ theo outline, embed và lưu vào ChromaDB
     - file_id: ID của file trên Google Drive
     - file_name: tên file trên drive
+    - service: Drive client, mặc định dùng get_gdrive_service()
+    Return: số chunk của tài liệu (0 nếu không trích được text)
     """
+    service = service or get_gdrive_service()
     os.makedirs(tmp_dir, exist_ok=True)
     local_path = os.path.join(tmp_dir, file_name)
-    download_from_gdrive_file(service, file_id, local_path)
-
-    if file_name.lower().endswith(".pdf"):
-        file_base = os.path.splitext(file_name)[0]
-        split_dir = os.path.join(tmp_dir, file_base)
-        os.makedirs(split_dir, exist_ok=True)
-
-        split_files = split_pdf_by_outline(local_path, split_dir)
-    else:
-        split_files = [local_path]
-
-
-    all_docs = []
-    for split_file in split_files:
-        docs = process_with_unstructured(split_file)
-        print(f"Chunks from {os.path.basename(split_file)}: {len(docs)}")
-        all_docs.extend(docs)
+    with ingest_stage("download"):
+        download_from_gdrive_file(service, file_id, local_path)
+
+    split_dir = os.path.join(tmp_dir, os.path.splitext(file_name)[0])
+    chunks = iter_document_chunks(local_path, split_dir)
+    total = embed_dataset(
+        chunks, persist_directory=persist_directory,
+        document_id=file_id, on_progress=on_progress, legacy_sources=legacy_source_paths(file_name)
+    )
+    print(f"Chunks from {file_name}: {total}")
 
-    embed_dataset(all_docs, persist_directory=persist_directory)
-    
     shutil.rmtree(tmp_dir, ignore_errors=True)
     print(f"🧹 Cleaned up {tmp_dir}")
+    return total
 
 
 def embed_local_file(
     file_path: str,
     persist_directory="chroma_db",
     tmp_dir="tmp_local",
-    split_by_outline: bool = True
+    split_by_outline: bool = True,
+    document_id: str = None,
+    on_progress=None
 ):
     """
     Ingest 1 file local (pdf, docx, xlsx, pptx, txt, csv...) vào ChromaDB
     - file_path: đường dẫn file local
     - persist_directory: thư mục ChromaDB
-    - tmp_dir: thư mục tạm để lưu split
+    - tmp_dir: thư mục tạm để lưu split (chỉ dùng khi PDF_SPLIT_MODE=files)
     - split_by_outline: nếu True và file là PDF thì tách outline
+    - document_id: id tài liệu, dùng để thay thế chunk của lần ingest trước
+    - on_progress: callback(số chunk đã xử lý)
     """
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"❌ File not found: {file_path}")
 
-    os.makedirs(tmp_dir, exist_ok=True)
     file_name = os.path.basename(file_path)
 
-    all_docs = []
-    if file_path.lower().endswith(".pdf") and split_by_outline:
-        file_base = os.path.splitext(file_name)[0]
-        split_dir = os.path.join(tmp_dir, file_base)
-        os.makedirs(split_dir, exist_ok=True)
-
-        split_files = split_pdf_by_outline(file_path, split_dir)
-
-        for split_pdf in split_files:
-            docs = process_with_unstructured(split_pdf)
-            all_docs.extend(docs)
-    else:
-        docs = process_with_unstructured(file_path)
-        all_docs.extend(docs)
+    split_dir = os.path.join(tmp_dir, os.path.splitext(file_name)[0])
+    chunks = iter_document_chunks(file_path, split_dir, split_by_outline)
+    total = embed_dataset(
+        chunks, persist_directory=persist_directory, document_id=document_id,
+        on_progress=on_progress, legacy_sources=legacy_source_paths(file_name) if document_id else None
+    )
+    shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    if not all_docs:
+    if not total:
         print(f"⚠️ No docs extracted from {file_name}, skipping embed.")
         return None
 
-    embed_dataset(all_docs, persist_directory=persist_directory)
-
-    shutil.rmtree(tmp_dir, ignore_errors=True)
     print(f"✅ Embedded {file_name} into {persist_directory}")
     return True
 
@@ -223,16 +554,25 @@ def embed_local_file(
 
 # ===================== MAIN =====================
 if __name__ == "__main__":
+    # python embed.py rebuild-lexical-index -> dựng BM25 index cho Chroma store đã có
+    if "rebuild-lexical-index" in sys.argv[1:]:
+        rebuild_lexical_index(CHROMA_DB_PATH or "chroma_db")
+        sys.exit(0)
+    # python embed.py export-flat-index -> export flat index từ Chroma store hiện có
+    if "export-flat-index" in sys.argv[1:]:
+        from langchain_community.vectorstores import Chroma
+
+        persist_directory = CHROMA_DB_PATH or "chroma_db"
+        vectordb = Chroma(persist_directory=persist_directory, embedding_function=get_embedding_model())
+        export_flat_index(vectordb._collection, persist_directory)
+        sys.exit(0)
+
     db_dir = "chroma_db"
     tmp_dir = "tmp_files"
     data_folder = r"C:\Users\ADMIN\Desktop\Data\test_chunking\Test_Data"
 
-    alldocs = []
-    for f in os.listdir(data_folder):
-        file_path = os.path.join(data_folder, f)
-        if not os.path.isfile(file_path):
-            continue
-        docs = process_with_unstructured(file_path)
-        alldocs.extend(docs)
-
-    embed_dataset(alldocs, persist_directory=db_dir)
+    file_paths = (
+        os.path.join(data_folder, f) for f in os.listdir(data_folder)
+        if os.path.isfile(os.path.join(data_folder, f))
+    )
+    embed_dataset(iter_chunks(file_paths), persist_directory=db_dir)
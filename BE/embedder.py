@@ -0,0 +1,106 @@
+import os
+import sys
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==== CONFIG ====
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+EMBEDDING_DEVICE = os.getenv("EMBEDDING_DEVICE", "cpu")
+EMBEDDING_BATCH_SIZE = int(os.getenv("EMBEDDING_BATCH_SIZE", "32"))
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))  # 0 = để torch / onnxruntime tự chọn
+# EMBEDDING_MODEL có prefix backend thì chạy bản ONNX của cùng model thay vì PyTorch, vd:
+#   onnx:sentence-transformers/all-MiniLM-L6-v2        -> onnx/model.onnx (fp32)
+#   onnx-int8:sentence-transformers/all-MiniLM-L6-v2   -> EMBEDDING_ONNX_INT8_FILE (dynamic quantized int8)
+# Vector gần như trùng bản torch (kiểm tra bằng embedding_benchmark.py) nên không cần embed lại Chroma.
+EMBEDDING_ONNX_FILE = os.getenv("EMBEDDING_ONNX_FILE", "onnx/model.onnx")
+EMBEDDING_ONNX_INT8_FILE = os.getenv("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+BACKEND_PREFIXES = {"onnx": EMBEDDING_ONNX_FILE, "onnx-int8": EMBEDDING_ONNX_INT8_FILE}
+
+_lock = threading.Lock()
+_embedding_model = None
+
+
+def parse_embedding_model(spec: str) -> tuple:
+    """ "onnx-int8:<model>" -> ("onnx-int8", "<model>"); không có prefix -> ("torch", spec)."""
+    backend, sep, model_name = spec.partition(":")
+    if sep and backend in BACKEND_PREFIXES:
+        return backend, model_name
+    return "torch", spec
+
+
+def load_embedding_model(spec: str = EMBEDDING_MODEL):
+    """Load 1 embedding model mới theo spec (có thể có prefix backend), luôn normalize."""
+    from langchain_community.embeddings import HuggingFaceEmbeddings
+
+    backend, model_name = parse_embedding_model(spec)
+    model_kwargs = {"device": EMBEDDING_DEVICE}
+    if backend == "torch":
+        if EMBEDDING_THREADS > 0:
+            import torch
+            torch.set_num_threads(EMBEDDING_THREADS)
+    else:
+        # sentence-transformers >= 3.2: backend="onnx", file_name chọn file trong repo / thư mục model
+        onnx_kwargs = {"file_name": BACKEND_PREFIXES[backend]}
+        if EMBEDDING_THREADS > 0:
+            import onnxruntime
+            session_options = onnxruntime.SessionOptions()
+            session_options.intra_op_num_threads = EMBEDDING_THREADS
+            onnx_kwargs["session_options"] = session_options
+        model_kwargs.update(backend="onnx", model_kwargs=onnx_kwargs)
+
+    return HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs=model_kwargs,
+        encode_kwargs={
+            "normalize_embeddings": True,
+            "batch_size": EMBEDDING_BATCH_SIZE,
+        },
+    )
+
+
+def get_embedding_model():
+    """
+    Embedding model dùng chung cho cả ingestion (embed.py) và query (bot.py).
+    Model chỉ load 1 lần / process, luôn normalize để cosine = dot product.
+    """
+    global _embedding_model
+    if _embedding_model is None:
+        with _lock:
+            if _embedding_model is None:
+                _embedding_model = load_embedding_model(EMBEDDING_MODEL)
+    return _embedding_model
+
+
+def warmup():
+    """Load model và chạy 1 lần encode để request đầu tiên không phải chờ."""
+    get_embedding_model().embed_query("warmup")
+    print(f"Embedding model ready: {EMBEDDING_MODEL} ({EMBEDDING_DEVICE})")
+
+
+def export_onnx_int8(spec: str, output_dir: str) -> str:
+    """
+    Export model sang ONNX + bản dynamic quantized int8 (cho model chưa có sẵn file trên hub).
+    Sau đó dùng EMBEDDING_MODEL = onnx-int8:<output_dir>.
+    """
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.backend import export_dynamic_quantized_onnx_model
+
+    _, model_name = parse_embedding_model(spec)
+    model = SentenceTransformer(model_name, backend="onnx", device=EMBEDDING_DEVICE)
+    model.save_pretrained(output_dir)
+    # "onnx/model_quint8_avx2.onnx" -> suffix "quint8_avx2", config "avx2"
+    file_suffix = os.path.splitext(os.path.basename(EMBEDDING_ONNX_INT8_FILE))[0].removeprefix("model_")
+    export_dynamic_quantized_onnx_model(
+        model, file_suffix.split("_", 1)[-1], output_dir, file_suffix=file_suffix
+    )
+    print(f"ONNX int8 model exported → {os.path.join(output_dir, EMBEDDING_ONNX_INT8_FILE)}")
+    return output_dir
+
+
+if __name__ == "__main__":
+    # python embedder.py export-onnx-int8 <output_dir>
+    if sys.argv[1:2] == ["export-onnx-int8"] and len(sys.argv) == 3:
+        export_onnx_int8(EMBEDDING_MODEL, sys.argv[2])
@@ -0,0 +1,164 @@
+"""
+So sánh embedding backend (ONNX / ONNX int8) với bản PyTorch của cùng model.
+
+Embed chunk của corpus fixture + bộ câu hỏi bằng cả 2 backend rồi ghi ra JSON:
+- parity: cosine giữa vector 2 backend của cùng 1 text (mean / min / p1 / p5)
+- retrieval: overlap top-k chunk cho từng câu hỏi giữa 2 backend
+- throughput: texts/s khi embed chunk (như ingest) và latency embed_query (như lúc serve)
+
+Chạy:
+    EMBEDDING_MODEL=onnx-int8:sentence-transformers/all-MiniLM-L6-v2 python embedding_benchmark.py
+    python embedding_benchmark.py --candidate onnx:sentence-transformers/all-MiniLM-L6-v2 --repeat 3
+"""
+import time
+import json
+import argparse
+from pathlib import Path
+from datetime import datetime, timezone
+import numpy as np
+from embedder import (
+    EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE,
+    EMBEDDING_THREADS,
+    parse_embedding_model,
+    load_embedding_model,
+)
+from benchmark import BENCH_DIR, summarize, load_questions, git_commit
+
+
+def load_texts(corpus_dir: Path) -> list:
+    from embed import new_splitter
+
+    splitter = new_splitter()
+    chunks = []
+    for path in sorted(p for p in corpus_dir.iterdir() if p.is_file()):
+        chunks.extend(splitter.split_text(path.read_text(encoding="utf-8")))
+    return chunks
+
+
+def run_backend(spec: str, chunks: list, questions: list, repeat: int) -> tuple:
+    """Return (chunk vectors, question vectors, throughput report) của 1 backend."""
+    start = time.perf_counter()
+    model = load_embedding_model(spec)
+    model.embed_query("warmup")
+    load_seconds = time.perf_counter() - start
+
+    ingest_seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunk_vectors = model.embed_documents(chunks)
+        ingest_seconds.append(time.perf_counter() - start)
+
+    query_latencies, question_vectors = [], []
+    for _ in range(repeat):
+        question_vectors = []
+        for question in questions:
+            start = time.perf_counter()
+            question_vectors.append(model.embed_query(question))
+            query_latencies.append(time.perf_counter() - start)
+
+    best = min(ingest_seconds)
+    report = {
+        "spec": spec,
+        "backend": parse_embedding_model(spec)[0],
+        "load_seconds": round(load_seconds, 3),
+        "ingest_seconds": round(best, 3),
+        "ingest_texts_per_sec": round(len(chunks) / best, 2) if best else None,
+        "embed_query": summarize(query_latencies),
+    }
+    return np.asarray(chunk_vectors, dtype=np.float32), np.asarray(question_vectors, dtype=np.float32), report
+
+
+def cosine_parity(reference, candidate) -> dict:
+    # Vector đã normalize nhưng int8 có thể lệch norm chút ít -> normalize lại cho chắc
+    reference = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    candidate = candidate / np.linalg.norm(candidate, axis=1, keepdims=True)
+    cosines = (reference * candidate).sum(axis=1)
+    parity = {"count": len(cosines), "mean": round(float(cosines.mean()), 6), "min": round(float(cosines.min()), 6)}
+    for p in (1, 5):
+        parity[f"p{p}"] = round(float(np.percentile(cosines, p)), 6)
+    return parity
+
+
+def topk_overlap(reference_chunks, reference_questions, candidate_chunks, candidate_questions, k: int) -> float:
+    def topk(chunks, questions):
+        return np.argsort(-(questions @ chunks.T), axis=1, kind="stable")[:, :k]
+
+    expected, actual = topk(reference_chunks, reference_questions), topk(candidate_chunks, candidate_questions)
+    return round(float(np.mean([len(set(e) & set(a)) / len(e) for e, a in zip(expected, actual)])), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an ONNX embedding backend with PyTorch.")
+    parser.add_argument("--corpus", type=Path, default=BENCH_DIR / "corpus")
+    parser.add_argument("--questions", type=Path, default=BENCH_DIR / "questions.jsonl")
+    parser.add_argument("--reference", default=None, help="mặc định: model của candidate chạy bằng torch")
+    parser.add_argument("--candidate", default=None, help="mặc định: EMBEDDING_MODEL (hoặc onnx-int8:<model>)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--output", type=Path, default=None)
+    args = parser.parse_args()
+
+    candidate = args.candidate or EMBEDDING_MODEL
+    backend, model_name = parse_embedding_model(candidate)
+    if backend == "torch" and not args.candidate:
+        candidate = f"onnx-int8:{model_name}"
+    reference = args.reference or model_name
+
+    chunks = load_texts(args.corpus)
+    questions = [item["question"] for item in load_questions(args.questions)]
+    print(f"Embedding {len(chunks)} chunks + {len(questions)} questions with {reference} and {candidate}")
+
+    ref_chunks, ref_questions, ref_report = run_backend(reference, chunks, questions, args.repeat)
+    cand_chunks, cand_questions, cand_report = run_backend(candidate, chunks, questions, args.repeat)
+
+    speedup = (
+        round(cand_report["ingest_texts_per_sec"] / ref_report["ingest_texts_per_sec"], 2)
+        if ref_report["ingest_texts_per_sec"] and cand_report["ingest_texts_per_sec"] else None
+    )
+    commit = git_commit()
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "config": {
+            "corpus": str(args.corpus),
+            "chunks": len(chunks),
+            "questions": len(questions),
+            "batch_size": EMBEDDING_BATCH_SIZE,
+            "threads": EMBEDDING_THREADS,
+            "repeat": args.repeat,
+        },
+        "reference": ref_report,
+        "candidate": cand_report,
+        "ingest_speedup": speedup,
+        "parity": {
+            "chunks": cosine_parity(ref_chunks, cand_chunks),
+            "questions": cosine_parity(ref_questions, cand_questions),
+            f"top_{args.k}_overlap": topk_overlap(ref_chunks, ref_questions, cand_chunks, cand_questions, args.k),
+        },
+    }
+
+    output = args.output or BENCH_DIR / "results" / (
+        f"embedding_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{commit}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(json.dumps({
+        "ingest_texts_per_sec": {
+            "reference": ref_report["ingest_texts_per_sec"],
+            "candidate": cand_report["ingest_texts_per_sec"],
+        },
+        "ingest_speedup": speedup,
+        "embed_query_p50_ms": {
+            "reference": ref_report["embed_query"].get("p50_ms"),
+            "candidate": cand_report["embed_query"].get("p50_ms"),
+        },
+        "parity": report["parity"],
+    }, indent=2))
+    print(f"Saved embedding benchmark results → {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+import os
+import json
+import mmap
+import time
+import uuid
+import shutil
+import threading
+from datetime import datetime, timezone
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==== CONFIG ====
+FLAT_INDEX_DIR = os.getenv("FLAT_INDEX_DIR", "flat_index")  # nằm trong thư mục Chroma
+FLAT_INDEX_DTYPE = os.getenv("FLAT_INDEX_DTYPE", "float32")  # float32 | int8
+FLAT_INDEX_BLOCK_ROWS = int(os.getenv("FLAT_INDEX_BLOCK_ROWS", "65536"))  # số vector / lần matmul
+FLAT_INDEX_RELOAD_INTERVAL = float(os.getenv("FLAT_INDEX_RELOAD_INTERVAL", "5"))  # giây
+FLAT_INDEX_KEEP_VERSIONS = 2
+# Build thêm HNSW (ann_index.py) cho mỗi version, mặc định bật khi serve bằng hnsw
+FLAT_INDEX_BUILD_HNSW = os.getenv(
+    "HNSW_BUILD", "true" if os.getenv("VECTOR_BACKEND") == "hnsw" else "false"
+).lower() in ("1", "true", "yes")
+
+CURRENT_FILE = "CURRENT"
+
+# Export + publish + dọn version cũ chạy tuần tự trong 1 process (ingest worker có thể export song song)
+_export_lock = threading.Lock()
+
+
+# -----------------------------
+# Export
+# -----------------------------
+def export_flat_index(collection, persist_directory: str, dtype: str = FLAT_INDEX_DTYPE,
+                      batch_size: int = 1000, build_hnsw: bool = FLAT_INDEX_BUILD_HNSW) -> str:
+    """
+    Export toàn bộ Chroma collection ra 1 version mới của flat index rồi publish atomic:
+        <persist_directory>/flat_index/<version>/
+            vectors.npy      N x D, float32 (hoặc int8 + scales.npy), đã normalize -> dot = cosine
+            metadata.jsonl   1 dòng / vector: {"id", "document", "metadata"}
+            offsets.npy      byte offset từng dòng metadata (N + 1) để đọc random qua mmap
+            sorted_ids.npy / sorted_rows.npy   tra row theo chunk_id (binary search)
+            manifest.json
+            hnsw.bin / hnsw.json (nếu build_hnsw, xem ann_index.py)
+        <persist_directory>/flat_index/CURRENT -> tên version đang dùng
+    Return: đường dẫn version vừa export
+    """
+    if dtype not in ("float32", "int8"):
+        raise ValueError(f"Unsupported flat index dtype: {dtype}")
+
+    with _export_lock:
+        return _export_version(collection, os.path.join(persist_directory, FLAT_INDEX_DIR),
+                               dtype, batch_size, build_hnsw)
+
+
+def _export_version(collection, root: str, dtype: str, batch_size: int, build_hnsw: bool) -> str:
+    # Tên version sort được theo thời gian; thêm suffix ngẫu nhiên để 2 process export cùng lúc không đụng thư mục
+    version = f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(root, version)
+    os.makedirs(path)
+
+    capacity = collection.count()
+    vectors = scales = None
+    ids, offsets = [], [0]
+    written = 0
+    with open(os.path.join(path, "metadata.jsonl"), "wb") as meta_file:
+        offset = 0
+        while written < capacity:
+            page = collection.get(
+                include=["embeddings", "documents", "metadatas"], limit=batch_size, offset=offset
+            )
+            if not len(page["ids"]):
+                break
+            offset += len(page["ids"])
+            batch = np.asarray(page["embeddings"], dtype=np.float32)[: capacity - written]
+            batch /= np.maximum(np.linalg.norm(batch, axis=1, keepdims=True), 1e-12)
+
+            if vectors is None:
+                vectors = np.lib.format.open_memmap(
+                    os.path.join(path, "vectors.npy"), mode="w+",
+                    dtype=np.int8 if dtype == "int8" else np.float32,
+                    shape=(capacity, batch.shape[1]),
+                )
+                if dtype == "int8":
+                    scales = np.lib.format.open_memmap(
+                        os.path.join(path, "scales.npy"), mode="w+", dtype=np.float32, shape=(capacity,)
+                    )
+
+            end = written + len(batch)
+            if dtype == "int8":
+                # Quantize đối xứng theo từng vector: v ≈ q * scale
+                batch_scales = np.maximum(np.abs(batch).max(axis=1), 1e-12) / 127
+                vectors[written:end] = np.round(batch / batch_scales[:, None]).astype(np.int8)
+                scales[written:end] = batch_scales
+            else:
+                vectors[written:end] = batch
+
+            for cid, text, meta in zip(page["ids"], page["documents"], page["metadatas"]):
+                if len(ids) == end:
+                    break
+                line = json.dumps({"id": cid, "document": text, "metadata": meta or {}}, ensure_ascii=False)
+                meta_file.write(line.encode("utf-8") + b"\n")
+                offsets.append(offsets[-1] + len(line.encode("utf-8")) + 1)
+                ids.append(cid)
+            written = end
+
+    dim = 0
+    for array in (vectors, scales):
+        if array is not None:
+            array.flush()
+    if vectors is not None:
+        dim = vectors.shape[1]
+        del vectors, scales
+
+    np.save(os.path.join(path, "offsets.npy"), np.asarray(offsets, dtype=np.int64))
+    id_array = np.asarray([cid.encode("utf-8") for cid in ids], dtype=bytes)
+    order = np.argsort(id_array, kind="stable")
+    np.save(os.path.join(path, "sorted_ids.npy"), id_array[order])
+    np.save(os.path.join(path, "sorted_rows.npy"), order.astype(np.int64))
+    with open(os.path.join(path, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "version": version,
+            "count": written,
+            "dim": dim,
+            "dtype": dtype,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }, f, indent=2)
+
+    if build_hnsw:
+        from ann_index import build_hnsw_index
+        build_hnsw_index(path)
+
+    _publish_version(root, version)
+    print(f"Flat index exported: {written} vectors ({dtype}) → {path}")
+    return path
+
+
+def _read_current(root: str):
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def _publish_version(root: str, version: str):
+    # Process khác đã publish version mới hơn trong lúc mình export -> không kéo CURRENT lùi lại
+    current = _read_current(root)
+    if current and current > version:
+        print(f"Flat index {version} is older than published {current}, not publishing")
+        return
+
+    # Publish: đổi CURRENT bằng os.replace nên reader không bao giờ thấy version dở dang
+    tmp_current = os.path.join(root, f"{CURRENT_FILE}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_current, "w") as f:
+        f.write(version)
+    os.replace(tmp_current, os.path.join(root, CURRENT_FILE))
+    _remove_old_versions(root, version)
+
+
+def _remove_old_versions(root: str, current: str):
+    # Chỉ xoá version cũ hơn version vừa publish: version mới hơn có thể đang được process khác export
+    versions = sorted(
+        name for name in os.listdir(root)
+        if os.path.isdir(os.path.join(root, name)) and name < current
+    )
+    # Giữ lại version trước đó cho process còn đang mmap; Linux vẫn đọc được file đã xoá
+    for name in versions[: max(len(versions) - (FLAT_INDEX_KEEP_VERSIONS - 1), 0)]:
+        shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+
+
+# -----------------------------
+# Reader
+# -----------------------------
+class FlatIndex:
+    """
+    Index vector phẳng đọc qua mmap: mọi worker process dùng chung 1 bản trong page cache,
+    top-k bằng matmul NumPy theo từng block FLAT_INDEX_BLOCK_ROWS vector.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.version = manifest["version"]
+        self.count = manifest["count"]
+        self.dim = manifest["dim"]
+        self.dtype = manifest["dtype"]
+
+        self.vectors = self.scales = None
+        if self.count:
+            self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")[: self.count]
+            if self.dtype == "int8":
+                self.scales = np.load(os.path.join(path, "scales.npy"), mmap_mode="r")[: self.count]
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.sorted_ids = np.load(os.path.join(path, "sorted_ids.npy"), mmap_mode="r")
+        self.sorted_rows = np.load(os.path.join(path, "sorted_rows.npy"), mmap_mode="r")
+
+        self._meta = None
+        with open(os.path.join(path, "metadata.jsonl"), "rb") as f:
+            if os.fstat(f.fileno()).st_size:
+                self._meta = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def search(self, query_embeddings, k: int):
+        """
+        Return (ids_per_query, rows) giống dense search của bot.py:
+            ids_per_query: list chunk_id theo thứ tự score giảm dần
+            rows: chunk_id -> (document, metadata, vector)
+        """
+        if not self.count or not len(query_embeddings):
+            return [[] for _ in query_embeddings], {}
+
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+
+        for start in range(0, self.count, FLAT_INDEX_BLOCK_ROWS):
+            block = self.vectors[start:start + FLAT_INDEX_BLOCK_ROWS]
+            scores = (block.astype(np.float32, copy=False) @ queries.T).T  # Q x B
+            if self.scales is not None:
+                scores *= self.scales[start:start + len(block)]
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_scores.shape[1] > k:
+                top = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+                best_rows = np.take_along_axis(best_rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+
+        rows = self.rows(np.unique(best_rows))
+        ids_by_row = {row: cid for cid, (_, _, _, row) in rows.items()}
+        ids_per_query = [[ids_by_row[row] for row in query_rows] for query_rows in best_rows.tolist()]
+        return ids_per_query, {cid: value[:3] for cid, value in rows.items()}
+
+    def get(self, ids) -> dict:
+        """chunk_id -> (document, metadata, vector), bỏ qua id không có trong index."""
+        if not len(self.sorted_ids) or not ids:
+            return {}
+        keys = np.asarray([cid.encode("utf-8") for cid in ids], dtype=bytes)
+        positions = np.searchsorted(self.sorted_ids, keys)
+        found = [
+            int(self.sorted_rows[pos]) for key, pos in zip(keys, positions)
+            if pos < len(self.sorted_ids) and self.sorted_ids[pos] == key
+        ]
+        return {cid: value[:3] for cid, value in self.rows(found).items()}
+
+    def rows(self, row_indices) -> dict:
+        result = {}
+        for row in row_indices:
+            row = int(row)
+            record = json.loads(self._meta[int(self.offsets[row]):int(self.offsets[row + 1])])
+            result[record["id"]] = (record["document"], record["metadata"], self.vector(row), row)
+        return result
+
+    def vector(self, row: int):
+        vec = np.asarray(self.vectors[row], dtype=np.float32)
+        return vec * self.scales[row] if self.scales is not None else vec
+
+
+_indexes = {}  # root -> [version, FlatIndex, checked_at]
+_indexes_lock = threading.Lock()
+
+
+def get_flat_index(persist_directory: str):
+    """
+    FlatIndex version mới nhất của persist_directory, None nếu chưa export.
+    Kiểm tra CURRENT tối đa mỗi FLAT_INDEX_RELOAD_INTERVAL giây để nhận bản export mới.
+    """
+    root = os.path.join(persist_directory, FLAT_INDEX_DIR)
+    now = time.monotonic()
+    with _indexes_lock:
+        entry = _indexes.get(root)
+        if entry is not None and now - entry[2] < FLAT_INDEX_RELOAD_INTERVAL:
+            return entry[1]
+        try:
+            with open(os.path.join(root, CURRENT_FILE)) as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            _indexes[root] = [None, None, now]
+            return None
+        if entry is None or entry[0] != version:
+            entry = [version, FlatIndex(os.path.join(root, version)), now]
+            _indexes[root] = entry
+        entry[2] = now
+        return entry[1]
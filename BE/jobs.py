@@ -0,0 +1,164 @@
+import os
+import uuid
+import socket
+import shutil
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+from embed import build_dataset_from_drive_file, embed_local_file, get_drive_file_checksum
+from Database import (
+    should_ingest,
+    claim_next_ingestion_job,
+    update_ingestion_job,
+    heartbeat_ingestion_jobs,
+    requeue_stale_jobs,
+)
+
+load_dotenv()
+
+# ==== CONFIG ====
+INGEST_JOB_CONCURRENCY = int(os.getenv("INGEST_JOB_CONCURRENCY", "1"))
+INGEST_JOB_POLL_INTERVAL = float(os.getenv("INGEST_JOB_POLL_INTERVAL", "2"))  # giây
+INGEST_SPOOL_DIR = os.getenv("INGEST_SPOOL_DIR", "ingest_spool")  # file upload chờ ingest
+INGEST_JOB_HEARTBEAT_INTERVAL = float(os.getenv("INGEST_JOB_HEARTBEAT_INTERVAL", "30"))  # giây
+# Job running không có heartbeat quá lâu -> worker đã chết, requeue cho worker khác
+INGEST_JOB_STALE_TIMEOUT = float(os.getenv("INGEST_JOB_STALE_TIMEOUT", "300"))  # giây
+
+
+def run_ingestion_job(job: dict, on_progress):
+    """
+    Chạy 1 job theo payload đã lưu trong ingestion_logs.
+    on_progress(processed, message, **fields): fields ghi thêm vào job (vd. content_hash).
+    Return: message kết thúc khác mặc định (vd. bỏ qua vì nội dung không đổi), None nếu không có
+    """
+    payload = job["payload"]
+    job_tmp = os.path.join("tmp_jobs", str(job["id"]))
+    if payload["kind"] == "drive":
+        # Checksum gọi Drive API nên tính trong job chứ không trong request /ingest_drive
+        on_progress(0, "Checking for changes")
+        checksum = get_drive_file_checksum(payload["file_id"])
+        last_modified = datetime.fromisoformat(job["last_modified"]) if job.get("last_modified") else None
+        if checksum and not should_ingest(job["document_id"], last_modified, checksum):
+            on_progress(0, "Content unchanged", content_hash=checksum)
+            return "Skipped, content unchanged"
+        on_progress(0, "Downloading", content_hash=checksum)
+        total = build_dataset_from_drive_file(
+            payload["file_id"], payload["file_name"],
+            tmp_dir=job_tmp,
+            on_progress=lambda n: on_progress(n, f"Embedded {n} chunks"),
+        )
+        if not total:
+            raise ValueError("No text extracted from file.")
+    elif payload["kind"] == "local":
+        result = embed_local_file(
+            payload["path"],
+            tmp_dir=job_tmp,
+            document_id=job["document_id"],
+            on_progress=lambda n: on_progress(n, f"Embedded {n} chunks"),
+        )
+        if not result:
+            raise ValueError("No text extracted from file.")
+    else:
+        raise ValueError(f"Unknown job kind: {payload['kind']}")
+
+
+def remove_spool_file(job: dict):
+    """File upload nằm trong thư mục riêng <spool>/<uuid>/, chỉ xoá khi job đã kết thúc."""
+    if job["payload"].get("kind") == "local":
+        shutil.rmtree(os.path.dirname(job["payload"]["path"]), ignore_errors=True)
+
+
+class IngestionWorker:
+    """
+    Worker pool chạy các job ingest đã được enqueue trong ingestion_logs.
+    Job được claim atomic kèm worker_id nên nhiều thread / nhiều process cùng chạy được;
+    worker heartbeat định kỳ, chỉ job của worker đã ngừng heartbeat mới bị requeue.
+    """
+
+    def __init__(self, concurrency: int, poll_interval: float,
+                 heartbeat_interval: float, stale_timeout: float):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_timeout = stale_timeout
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._stop.clear()
+        self._requeue_stale()
+        self._threads.append(
+            threading.Thread(target=self._heartbeat, name="ingest-heartbeat", daemon=True)
+        )
+        for i in range(self.concurrency):
+            self._threads.append(
+                threading.Thread(target=self._run, name=f"ingest-worker-{i}", daemon=True)
+            )
+        for thread in self._threads:
+            thread.start()
+
+    def notify(self):
+        """Báo có job mới để worker không phải chờ hết poll_interval."""
+        self._wake.set()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def _requeue_stale(self):
+        requeued = requeue_stale_jobs(self.stale_timeout)
+        if requeued:
+            print(f"Requeued {requeued} interrupted ingestion job(s).")
+            self._wake.set()
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.heartbeat_interval):
+            try:
+                heartbeat_ingestion_jobs(self.worker_id)
+                self._requeue_stale()
+            except Exception as e:
+                print(f"Ingestion heartbeat failed: {e}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = claim_next_ingestion_job(self.worker_id)
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._execute(job)
+
+    def _execute(self, job: dict):
+        job_id = job["id"]
+        print(f"Starting ingestion job {job_id} for {job['document_name']}...")
+
+        def on_progress(processed: int, message: str, **fields):
+            update_ingestion_job(job_id, progress=processed, message=message, worker_id=self.worker_id, **fields)
+
+        try:
+            status, message = "success", run_ingestion_job(job, on_progress) or "Completed"
+            print(f"✅ Ingestion job {job_id} completed.")
+        except Exception as e:
+            status, message = "failed", str(e)
+            print(f"❌ Ingestion job {job_id} failed: {e}")
+        finally:
+            shutil.rmtree(os.path.join("tmp_jobs", str(job_id)), ignore_errors=True)
+
+        if update_ingestion_job(job_id, status=status, message=message, worker_id=self.worker_id):
+            remove_spool_file(job)
+        else:
+            # Job đã bị requeue cho worker khác (mất heartbeat), để worker đó kết thúc + dọn file
+            print(f"Ingestion job {job_id} was taken over by another worker.")
+
+
+ingestion_worker = IngestionWorker(
+    INGEST_JOB_CONCURRENCY,
+    INGEST_JOB_POLL_INTERVAL,
+    INGEST_JOB_HEARTBEAT_INTERVAL,
+    INGEST_JOB_STALE_TIMEOUT,
+)
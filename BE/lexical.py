@@ -0,0 +1,138 @@
+import os
+import re
+import sqlite3
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==== CONFIG ====
+LEXICAL_INDEX_FILE = os.getenv("LEXICAL_INDEX_FILE", "lexical.db")  # nằm trong thư mục Chroma
+LEXICAL_MAX_TERMS = int(os.getenv("LEXICAL_MAX_TERMS", "32"))
+LEXICAL_MIN_TERM_LENGTH = int(os.getenv("LEXICAL_MIN_TERM_LENGTH", "2"))  # term ngắn hơn bị bỏ (trừ số)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Từ phổ biến trong câu hỏi (EN + VI): OR vào MATCH thì khớp gần như mọi chunk và lấn át
+# các term hiếm như mã lỗi trong BM25 candidates
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in into is it its me my
+no not of on or our so that the their them then there these this to was we what when where
+which who why will with you your
+à ạ ai anh bạn bị các cái cách cho chị có của cũng đã đang để đó được em gì hãy hay khi không
+là làm lại mà mình một này nào nên nếu như những ở ra rồi sao sẽ tại thế thì tôi trên trong
+từ và vào về với vậy
+""".split())
+
+
+class LexicalIndex:
+    """
+    Inverted index BM25 (SQLite FTS5) của các chunk đã embed, dùng chung chunk_id với Chroma.
+    Bắt được token chính xác như mã lỗi 0x80070005 hay KB5005565 mà embedding hay bỏ sót;
+    tra cứu đi qua posting list nên chi phí theo số chunk khớp, không quét toàn bộ.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        conn = self._conn()
+        with conn:
+            # chunks giữ chunk_id <-> rowid để xoá theo chunk_id không phải quét FTS
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS chunks (
+                    rowid INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    document_id TEXT
+                )"""
+            )
+            conn.execute(
+                """CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts
+                   USING fts5(content, tokenize = 'unicode61 remove_diacritics 2')"""
+            )
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def add(self, ids: list, texts: list, document_ids: list = None):
+        """Thêm chunk (bỏ qua chunk_id đã có)."""
+        document_ids = document_ids or [None] * len(ids)
+        conn = self._conn()
+        with self._write_lock, conn:
+            for cid, text, document_id in zip(ids, texts, document_ids):
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO chunks (chunk_id, document_id) VALUES (?, ?)",
+                    (cid, document_id),
+                )
+                if cursor.rowcount:
+                    conn.execute(
+                        "INSERT INTO chunks_fts (rowid, content) VALUES (?, ?)",
+                        (cursor.lastrowid, text),
+                    )
+
+    def delete(self, ids: list):
+        conn = self._conn()
+        with self._write_lock, conn:
+            for cid in ids:
+                row = conn.execute("SELECT rowid FROM chunks WHERE chunk_id = ?", (cid,)).fetchone()
+                if row is None:
+                    continue
+                conn.execute("DELETE FROM chunks_fts WHERE rowid = ?", (row[0],))
+                conn.execute("DELETE FROM chunks WHERE rowid = ?", (row[0],))
+
+    def clear(self):
+        conn = self._conn()
+        with self._write_lock, conn:
+            conn.execute("DELETE FROM chunks_fts")
+            conn.execute("DELETE FROM chunks")
+
+    def search(self, query: str, k: int) -> list:
+        """Top-k chunk_id theo BM25 (gần nhất trước). Câu hỏi được tách thành các term OR với nhau."""
+        match = build_match_query(query)
+        if not match:
+            return []
+        rows = self._conn().execute(
+            """SELECT c.chunk_id
+               FROM chunks_fts
+               JOIN chunks c ON c.rowid = chunks_fts.rowid
+               WHERE chunks_fts MATCH ?
+               ORDER BY bm25(chunks_fts)
+               LIMIT ?""",
+            (match, k),
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def build_match_query(query: str) -> str:
+    tokens = list(dict.fromkeys(t.lower() for t in _TOKEN_RE.findall(query)))
+    terms = [
+        t for t in tokens
+        if t not in STOPWORDS and (len(t) >= LEXICAL_MIN_TERM_LENGTH or t.isdigit())
+    ]
+    # Câu hỏi chỉ toàn stopword thì vẫn search theo câu gốc thay vì bỏ hẳn nhánh lexical
+    terms = (terms or tokens)[:LEXICAL_MAX_TERMS]
+    # quote từng term để FTS5 không hiểu nhầm thành toán tử (AND, NEAR, ...)
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_lexical_index(persist_directory: str) -> LexicalIndex:
+    """1 LexicalIndex / thư mục Chroma / process."""
+    path = os.path.join(persist_directory, LEXICAL_INDEX_FILE)
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = LexicalIndex(path)
+        return _indexes[path]
@@ -0,0 +1,138 @@
+import os
+import queue
+import threading
+from dotenv import load_dotenv
+from Database import (
+    transaction,
+    query_log_row,
+    insert_query_logs,
+    update_query_confidences,
+    allocate_log_ids,
+)
+from telemetry import db_call
+
+load_dotenv()
+
+# ==== CONFIG ====
+LOG_WRITER_BATCH_SIZE = int(os.getenv("LOG_WRITER_BATCH_SIZE", "100"))
+LOG_WRITER_FLUSH_INTERVAL = float(os.getenv("LOG_WRITER_FLUSH_INTERVAL", "0.5"))  # giây
+LOG_WRITER_QUEUE_SIZE = int(os.getenv("LOG_WRITER_QUEUE_SIZE", "10000"))
+# Queue đầy thì chờ tối đa bấy nhiêu giây rồi ghi thẳng (back-pressure)
+LOG_WRITER_PUT_TIMEOUT = float(os.getenv("LOG_WRITER_PUT_TIMEOUT", "1"))
+LOG_ID_BLOCK_SIZE = int(os.getenv("LOG_ID_BLOCK_SIZE", "100"))
+
+_INSERT = "insert"
+_CONFIDENCE = "confidence"
+
+
+class QueryLogWriter:
+    """
+    Ghi query_logs bất đồng bộ theo batch (group commit) từ 1 thread riêng.
+    - log() trả log_id ngay, lấy từ block id cấp trước trong sqlite_sequence
+    - Queue có giới hạn: đầy thì request chờ, quá put_timeout thì tự ghi đồng bộ
+    - stop() ghi nốt mọi thứ còn trong queue
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, queue_size: int,
+                 put_timeout: float, id_block_size: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.id_block_size = id_block_size
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._id_lock = threading.Lock()
+        self._ids = iter(())
+        self._stop = threading.Event()
+        self._thread = None
+
+    def next_log_id(self) -> int:
+        with self._id_lock:
+            log_id = next(self._ids, None)
+            if log_id is None:
+                self._ids = iter(allocate_log_ids(self.id_block_size))
+                log_id = next(self._ids)
+            return log_id
+
+    def log(self, question_id: str, user_id: str, channel_id: str,
+            query: str, answer: str, similarity_score: float) -> int:
+        log_id = self.next_log_id()
+        row = query_log_row(
+            question_id, user_id, channel_id, query, answer, similarity_score, log_id=log_id
+        )
+        self._put((_INSERT, row))
+        return log_id
+
+    def update_confidence(self, log_id: int, similarity_score: float):
+        self._put((_CONFIDENCE, (log_id, similarity_score)))
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="query-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """Ghi hết những gì đang chờ trong queue."""
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def _put(self, item):
+        try:
+            self._queue.put(item, timeout=self.put_timeout)
+        except queue.Full:
+            print("Query log queue full, writing synchronously.")
+            self._write([item])
+
+    def _drain(self, first=None) -> list:
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            self._write(self._drain(first))
+
+    def _write(self, batch: list):
+        # update confidence luôn đến sau insert của chính log đó nên ghi insert trước
+        rows = [payload for kind, payload in batch if kind == _INSERT]
+        updates = [payload for kind, payload in batch if kind == _CONFIDENCE]
+        try:
+            with db_call("query_log_batch"), transaction(immediate=True) as conn:
+                if rows:
+                    insert_query_logs(conn, rows)
+                if updates:
+                    update_query_confidences(conn, updates)
+        except Exception as e:
+            if len(batch) == 1:
+                print(f"❌ Failed to write query log {batch[0]}: {e}")
+                return
+            # 1 dòng lỗi không được làm mất cả batch
+            print(f"Query log batch failed ({e}), retrying row by row.")
+            for item in batch:
+                self._write([item])
+
+
+query_log_writer = QueryLogWriter(
+    LOG_WRITER_BATCH_SIZE,
+    LOG_WRITER_FLUSH_INTERVAL,
+    LOG_WRITER_QUEUE_SIZE,
+    LOG_WRITER_PUT_TIMEOUT,
+    LOG_ID_BLOCK_SIZE,
+)
@@ -1,52 +1,117 @@
+import os
+import time
 import datetime
+import threading
 import pandas as pd
 from Database import get_db_connection
+from telemetry import timed_db
 
-def GetMetrics():
+METRICS_CACHE_TTL = float(os.getenv("METRICS_CACHE_TTL", "10"))  # giây
+METRICS_CACHE_MAX_ENTRIES = int(os.getenv("METRICS_CACHE_MAX_ENTRIES", "256"))
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+def cached(key, loader, ttl: float = METRICS_CACHE_TTL):
+    """
+    Cache kết quả loader() trong process, hết hạn sau ttl giây.
+    Mỗi lần ghi dọn entry hết hạn và giữ tối đa METRICS_CACHE_MAX_ENTRIES (bỏ entry cũ nhất),
+    vì key có page / page_size do client gửi lên.
+    """
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+    value = loader()
+    with _cache_lock:
+        for expired in [k for k, (expires_at, _) in _cache.items() if expires_at <= now]:
+            del _cache[expired]
+        _cache.pop(key, None)
+        _cache[key] = (now + ttl, value)  # dict giữ thứ tự ghi -> entry đầu là cũ nhất
+        while len(_cache) > METRICS_CACHE_MAX_ENTRIES:
+            del _cache[next(iter(_cache))]
+    return value
+
+
+@timed_db
+def QueryMetricCounters():
+    """Tất cả counter của dashboard trong 1 lần quét."""
     conn = get_db_connection()
-    cur = conn.cursor()
     now = datetime.datetime.now()
-
-    # Today's questions
     today = now.date().isoformat()
-    cur.execute("SELECT COUNT(*) FROM query_logs WHERE DATE(timestamp) = ?", (today,))
-    today_count = cur.fetchone()[0]
-
-    # This week's questions
     startWeek = (now - datetime.timedelta(days=now.weekday())).date().isoformat()
-    cur.execute("SELECT COUNT(*) FROM query_logs WHERE DATE(timestamp) >= ?", (startWeek,))
-    week_count = cur.fetchone()[0]
-
-    # This month's questions
     startMonth = now.replace(day=1).date().isoformat()
-    cur.execute("SELECT COUNT(*) FROM query_logs WHERE DATE(timestamp) >= ?", (startMonth,))
-    month_count = cur.fetchone()[0]
 
-    # AI answered and escalated
-    cur.execute("SELECT COUNT(*) FROM query_logs")
-    total = cur.fetchone()[0]
-    cur.execute("SELECT COUNT(*) FROM query_logs WHERE flagged=1")
-    escalated = cur.fetchone()[0]
-    ai_answered = total - escalated
+    # Đọc từ rollup daily_stats (1 dòng / ngày) thay vì quét query_logs
+    row = conn.execute(
+        """
+        SELECT
+            COALESCE(SUM(total_queries), 0) AS total,
+            COALESCE(SUM(CASE WHEN day = ? THEN total_queries ELSE 0 END), 0) AS today_count,
+            COALESCE(SUM(CASE WHEN day >= ? THEN total_queries ELSE 0 END), 0) AS week_count,
+            COALESCE(SUM(CASE WHEN day >= ? THEN total_queries ELSE 0 END), 0) AS month_count,
+            COALESCE(SUM(escalated), 0) AS escalated
+        FROM daily_stats
+        """,
+        (today, startWeek, startMonth),
+    ).fetchone()
+    return dict(row)
 
-    query = "SELECT question FROM query_logs WHERE flagged=1"
-    escalated_table = pd.read_sql(query, conn)
 
-    conn.close()
-    return today_count, week_count, month_count, ai_answered, escalated, escalated_table
+@timed_db
+def QueryEscalatedPage(page: int, page_size: int):
+    conn = get_db_connection()
+    rows = conn.execute(
+        """
+        SELECT log_id, question, day
+        FROM query_logs
+        WHERE flagged = 1
+        ORDER BY day DESC, log_id DESC
+        LIMIT ? OFFSET ?
+        """,
+        (page_size, (page - 1) * page_size),
+    ).fetchall()
+    return [dict(row) for row in rows]
 
+
+def GetMetrics(page: int = 1, page_size: int = 50):
+    """
+    Counter cho dashboard + 1 trang danh sách câu hỏi escalated (mới nhất trước).
+    page bị kẹp trong [1, tổng số trang]. Kết quả được cache METRICS_CACHE_TTL giây.
+    """
+    counters = cached("counters", QueryMetricCounters)
+    total_pages = max((counters["escalated"] + page_size - 1) // page_size, 1)
+    page = min(max(page, 1), total_pages)
+    escalated_table = cached(
+        ("escalated", page, page_size), lambda: QueryEscalatedPage(page, page_size)
+    )
+
+    escalated = counters["escalated"]
+    ai_answered = counters["total"] - escalated
+    return (
+        counters["today_count"],
+        counters["week_count"],
+        counters["month_count"],
+        ai_answered,
+        escalated,
+        escalated_table,
+        page,
+    )
+
+@timed_db
 def GetNegativeFeedbackTrend():
     conn = get_db_connection()
     query = """
-        SELECT DATE(timestamp) as Day, SUM(thumbs_down) as Negative_Feedback
-        FROM query_logs
-        GROUP BY DATE(timestamp)
-        ORDER BY Day
+        SELECT day as Day, thumbs_down as Negative_Feedback
+        FROM daily_stats
+        ORDER BY day
     """
     df = pd.read_sql(query, conn)
-    conn.close()
     return df
 
+@timed_db
 def GetIngestionHistory():
     conn = get_db_connection()
     query = """
@@ -59,9 +124,9 @@ def GetIngestionHistory():
         ORDER BY last_modified DESC
     """
     df = pd.read_sql(query, conn)
-    conn.close()
     return df
 
+@timed_db
 def ShowHardQuestions():
     conn = get_db_connection()
     query = """
@@ -80,5 +145,4 @@ def ShowHardQuestions():
             GROUP BY question;
     """
     df = pd.read_sql(query, conn)
-    conn.close()
     return df
\ No newline at end of file
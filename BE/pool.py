@@ -0,0 +1,59 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==== CONFIG ====
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", "4"))
+QUERY_QUEUE_DEPTH = int(os.getenv("QUERY_QUEUE_DEPTH", "32"))
+BACKGROUND_CONCURRENCY = int(os.getenv("BACKGROUND_CONCURRENCY", "2"))
+BACKGROUND_QUEUE_DEPTH = int(os.getenv("BACKGROUND_QUEUE_DEPTH", "256"))
+# /query/batch: số câu gọi LLM song song của 1 batch (dùng chung query_pool)
+QUERY_BATCH_CONCURRENCY = int(os.getenv("QUERY_BATCH_CONCURRENCY", "2"))
+QUERY_BATCH_MAX_SIZE = int(os.getenv("QUERY_BATCH_MAX_SIZE", "200"))
+QUERY_BATCH_RETRY_DELAY = float(os.getenv("QUERY_BATCH_RETRY_DELAY", "0.5"))  # giây, khi query_pool đầy
+
+
+class PoolBusyError(Exception):
+    """Pool đã nhận đủ số job (đang chạy + đang chờ), không nhận thêm."""
+
+
+class BoundedPool:
+    """
+    Thread pool có giới hạn để chạy code sync (embedding, Chroma, Gemini, sqlite)
+    mà không block event loop.
+    - max_workers: số job chạy song song
+    - queue_depth: số job được phép chờ thêm; vượt quá thì raise PoolBusyError
+    """
+
+    def __init__(self, max_workers: int, queue_depth: int, name: str = "pool"):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix=name
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + queue_depth)
+
+    def submit(self, fn, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusyError("Server is busy, please retry later.")
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+        # Trả slot khi job thật sự xong, kể cả khi request phía trên đã bị huỷ
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    async def run(self, fn, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+query_pool = BoundedPool(QUERY_CONCURRENCY, QUERY_QUEUE_DEPTH, name="query")
+# Việc không nằm trên request path (vd. chấm LLM confidence ở background)
+background_pool = BoundedPool(BACKGROUND_CONCURRENCY, BACKGROUND_QUEUE_DEPTH, name="background")
@@ -0,0 +1,132 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+from Database import apply_reaction_deltas
+
+load_dotenv()
+
+# ==== CONFIG ====
+REACTION_FLUSH_SIZE = int(os.getenv("REACTION_FLUSH_SIZE", "200"))          # số event chờ thì flush ngay
+REACTION_FLUSH_INTERVAL = float(os.getenv("REACTION_FLUSH_INTERVAL", "1"))  # giây
+# Số lần flush thử lại delta của question_id chưa có trong query_logs (log chưa kịp ghi)
+REACTION_RETRY_LIMIT = int(os.getenv("REACTION_RETRY_LIMIT", "30"))
+# Lúc shutdown: flush lặp lại tối đa bao nhiêu giây cho delta đang retry / ghi lỗi
+REACTION_DRAIN_TIMEOUT = float(os.getenv("REACTION_DRAIN_TIMEOUT", "5"))
+
+
+class ReactionBuffer:
+    """
+    Gom reaction từ webhook Slack vào bộ nhớ và ghi theo batch.
+    - Các event cùng question_id được cộng dồn thành 1 net delta trước khi ghi. Clamp về 0
+      áp dụng cho net delta chứ không cho từng event: count 0 nhận remove rồi add trong cùng
+      1 flush -> vẫn 0 (ghi từng event như trước sẽ ra 1)
+    - Flush khi đủ flush_size event hoặc sau flush_interval giây
+    - stop() flush lặp lại tới khi hết delta hoặc quá drain_timeout giây, delta còn lại được log;
+      chỉ mất tối đa flush_interval giây dữ liệu nếu process bị kill
+    """
+
+    def __init__(self, flush_size: int, flush_interval: float, retry_limit: int,
+                 drain_timeout: float = REACTION_DRAIN_TIMEOUT):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.retry_limit = retry_limit
+        self.drain_timeout = drain_timeout
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._deltas = {}     # question_id -> [thumbs_up, thumbs_down]
+        self._attempts = {}   # question_id -> số lần flush không tìm thấy dòng
+        self._pending = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, question_id: str, thumbs_up: int, thumbs_down: int):
+        """thumbs_up / thumbs_down là delta: +1 khi reaction_added, -1 khi reaction_removed."""
+        with self._lock:
+            delta = self._deltas.setdefault(question_id, [0, 0])
+            delta[0] += thumbs_up
+            delta[1] += thumbs_down
+            self._pending += 1
+            full = self._pending >= self.flush_size
+        if full:
+            self._wake.set()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="reaction-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+        # Delta của log chưa ghi xong hoặc gặp lỗi DB được merge lại buffer -> flush tiếp tới deadline
+        deadline = time.monotonic() + self.drain_timeout
+        self.flush()
+        while self._has_pending() and time.monotonic() < deadline:
+            time.sleep(min(self.flush_interval, max(deadline - time.monotonic(), 0)))
+            self.flush()
+
+        with self._lock:
+            dropped = {qid: tuple(d) for qid, d in self._deltas.items() if d != [0, 0]}
+            self._deltas = {}
+            self._pending = 0
+        self._attempts.clear()
+        for qid, delta in dropped.items():
+            print(f"Dropping reaction delta for question_id {qid} on shutdown: {delta}")
+
+    def _has_pending(self) -> bool:
+        with self._lock:
+            return any(d != [0, 0] for d in self._deltas.values())
+
+    def flush(self) -> int:
+        """Ghi toàn bộ delta đang chờ, trả về số question_id đã ghi."""
+        with self._flush_lock:
+            with self._lock:
+                batch = {qid: tuple(d) for qid, d in self._deltas.items() if d != [0, 0]}
+                self._deltas = {}
+                self._pending = 0
+            if not batch:
+                return 0
+
+            try:
+                missing = apply_reaction_deltas(batch)
+            except Exception as e:
+                print(f"❌ Reaction flush failed, will retry: {e}")
+                self._merge(batch)
+                return 0
+
+            retry = {}
+            for qid in missing:
+                attempts = self._attempts.get(qid, 0) + 1
+                if attempts >= self.retry_limit:
+                    self._attempts.pop(qid, None)
+                    print(f"Dropping reaction delta for unknown question_id {qid}: {batch[qid]}")
+                else:
+                    self._attempts[qid] = attempts
+                    retry[qid] = batch[qid]
+            for qid in batch:
+                if qid not in retry:
+                    self._attempts.pop(qid, None)
+            self._merge(retry)
+            return len(batch) - len(missing)
+
+    def _merge(self, batch: dict):
+        with self._lock:
+            for qid, (up, down) in batch.items():
+                delta = self._deltas.setdefault(qid, [0, 0])
+                delta[0] += up
+                delta[1] += down
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+
+reaction_buffer = ReactionBuffer(REACTION_FLUSH_SIZE, REACTION_FLUSH_INTERVAL, REACTION_RETRY_LIMIT)
@@ -1,4 +1,3 @@
-import sqlite3
 import pandas as pd
 import datetime
 from pathlib import Path
@@ -21,16 +20,15 @@ def QueryDailyData():
     conn = get_db_connection()
     query = """
         SELECT 
-            COUNT(*) as TotalQuery,
-            SUM(CASE WHEN flagged=0 THEN 1 ELSE 0 END) as AIAnswered,
-            SUM(CASE WHEN flagged=1 THEN 1 ELSE 0 END) as Escalated,
-            SUM(Thumps_up) as Like,
-            SUM(Thumps_down) as Dislike
-        FROM query_logs
-        WHERE DATE(timestamp) = ?
+            COALESCE(SUM(total_queries), 0) as TotalQuery,
+            COALESCE(SUM(total_queries - escalated), 0) as AIAnswered,
+            COALESCE(SUM(escalated), 0) as Escalated,
+            COALESCE(SUM(thumbs_up), 0) as Like,
+            COALESCE(SUM(thumbs_down), 0) as Dislike
+        FROM daily_stats
+        WHERE day = ?
     """
-    df = pd.read_sql(query, conn, params=(today,))
-    conn.close()
+    df = pd.read_sql(query, conn, params=(today.isoformat(),))
     total = df.loc[0, "TotalQuery"]
     ai_answered = df.loc[0, "AIAnswered"] or 0
     escalated = df.loc[0, "Escalated"] or 0
@@ -52,19 +50,17 @@ def QueryWeeklyData():
 
     conn = get_db_connection()
     query = """
-        SELECT DATE(timestamp) as Day,
-               COUNT(*) as TotalQuery,
-               SUM(CASE WHEN flagged=0 THEN 1 ELSE 0 END) as AIAnswered,
-               SUM(CASE WHEN flagged=1 THEN 1 ELSE 0 END) as Escalated,
-               SUM(Thumps_up) as Like,
-               SUM(Thumps_down) as Dislike
-        FROM query_logs
-        WHERE DATE(timestamp) BETWEEN ? AND ?
-        GROUP BY DATE(timestamp)
-        ORDER BY Day
+        SELECT day as Day,
+               total_queries as TotalQuery,
+               total_queries - escalated as AIAnswered,
+               escalated as Escalated,
+               thumbs_up as Like,
+               thumbs_down as Dislike
+        FROM daily_stats
+        WHERE day BETWEEN ? AND ?
+        ORDER BY day
     """
     df = pd.read_sql(query, conn, params=(start_week.isoformat(), end_week.isoformat()))
-    conn.close()
 
     start_week, end_week = GetWeekRange()
     # Tính tỷ lệ
@@ -1,4 +1,5 @@
 import os
+from io import BytesIO
 from pypdf import PdfReader, PdfWriter
 from pypdf.generic import Destination
 
@@ -16,21 +17,12 @@ def flatten_outlines(outlines):
             flat.append(o)
     return flat
 
-def split_pdf_by_outline(input_file: str, output_root: str = "data_split"):
-    file_name = os.path.basename(input_file)
-    base_name = os.path.splitext(file_name)[0]
-
-    # Nếu không truyền output_root thì folder output = cùng cấp với file gốc
-    if output_root is None:
-        output_root = os.path.dirname(input_file)
-
-    # Folder xuất ra = <output_root>/<tên file pdf>
-    file_output_dir = os.path.join(output_root, base_name)
-    os.makedirs(file_output_dir, exist_ok=True)
-
-    print(f"\nProcessing file: {file_name}")
-    reader = PdfReader(input_file)
-
+def get_outline_ranges(reader: PdfReader):
+    """
+    Tính khoảng trang cho từng outline
+    Return: list (index, title, start_page, end_page) - start_page tính từ 0, end_page không bao gồm.
+            [] nếu file không có outline hợp lệ
+    """
     try:
         outlines = reader.outline
     except Exception:
@@ -38,7 +30,7 @@ def split_pdf_by_outline(input_file: str, output_root: str = "data_split"):
 
     if not outlines:
         print("This file has no outline/bookmark.")
-        return [input_file]
+        return []
 
     flat_outlines = flatten_outlines(outlines)
 
@@ -54,15 +46,14 @@ def split_pdf_by_outline(input_file: str, output_root: str = "data_split"):
 
     if not valid_outlines:
         print("No valid outlines found for splitting.")
-        return
+        return []
 
     print(f"Found {len(valid_outlines)} valid outlines:")
     for i, outline in enumerate(valid_outlines, 1):
         print(f"      {i}. {outline.title}")
-    output_files = []
-    # Tách file theo outline
+
+    ranges = []
     for i, outline in enumerate(valid_outlines, 1):
-        title = sanitize_filename(outline.title)
         start_page = reader.get_destination_page_number(outline)
 
         if i < len(valid_outlines):
@@ -74,13 +65,59 @@ def split_pdf_by_outline(input_file: str, output_root: str = "data_split"):
         if end_page is None or start_page is None or end_page <= start_page:
             continue
 
-        writer = PdfWriter()
-        for p in range(start_page, end_page):
-            writer.add_page(reader.pages[p])
+        ranges.append((i, outline.title, start_page, end_page))
+    return ranges
+
+
+def write_pages(reader: PdfReader, start_page: int, end_page: int, output):
+    writer = PdfWriter()
+    for p in range(start_page, end_page):
+        writer.add_page(reader.pages[p])
+    writer.write(output)
+
 
-        output_path = os.path.join(file_output_dir, f"{i:02d}_{title}.pdf")
+def iter_pdf_sections(reader: PdfReader, ranges):
+    """
+    Tách PDF theo outline ngay trong RAM (không ghi file tạm)
+    Yield dict: index, title, start_page, end_page (đánh số từ 1, bao gồm cả 2 đầu) và data (bytes PDF của section)
+    """
+    for i, title, start_page, end_page in ranges:
+        buffer = BytesIO()
+        write_pages(reader, start_page, end_page, buffer)
+        yield {
+            "index": i,
+            "title": title,
+            "start_page": start_page + 1,
+            "end_page": end_page,
+            "data": buffer.getvalue(),
+        }
+
+
+def split_pdf_by_outline(input_file: str, output_root: str = "data_split"):
+    file_name = os.path.basename(input_file)
+    base_name = os.path.splitext(file_name)[0]
+
+    # Nếu không truyền output_root thì folder output = cùng cấp với file gốc
+    if output_root is None:
+        output_root = os.path.dirname(input_file)
+
+    # Folder xuất ra = <output_root>/<tên file pdf>
+    file_output_dir = os.path.join(output_root, base_name)
+    os.makedirs(file_output_dir, exist_ok=True)
+
+    print(f"\nProcessing file: {file_name}")
+    reader = PdfReader(input_file)
+
+    ranges = get_outline_ranges(reader)
+    if not ranges:
+        return [input_file]
+
+    output_files = []
+    # Tách file theo outline
+    for i, title, start_page, end_page in ranges:
+        output_path = os.path.join(file_output_dir, f"{i:02d}_{sanitize_filename(title)}.pdf")
         with open(output_path, "wb") as f:
-            writer.write(f)
+            write_pages(reader, start_page, end_page, f)
         output_files.append(output_path)
         print(f"Exported: {output_path}")
 
@@ -0,0 +1,90 @@
+import os
+import time
+import threading
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==== CONFIG ====
+# true  -> load model / Chroma / Gemini client ở background ngay khi app start
+# false -> chỉ load khi request đầu tiên cần tới
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "true").lower() in ("1", "true", "yes")
+
+PENDING, RUNNING, READY, FAILED, LAZY = "pending", "running", "ready", "failed", "lazy"
+
+
+class StartupReport:
+    """
+    Thời gian + trạng thái từng bước khởi động (import, warmup từng component), trả về qua /ready.
+    App ready khi mọi bước đã đăng ký đều READY (hoặc LAZY khi tắt warmup).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.perf_counter()
+        self._last_mark = self._started
+        self._steps = {}  # name -> {"status", "seconds", "error"}
+
+    def mark(self, name: str):
+        """Ghi 1 bước đồng bộ đã xong, thời gian tính từ lần mark trước."""
+        now = time.perf_counter()
+        with self._lock:
+            self._steps[name] = {"status": READY, "seconds": round(now - self._last_mark, 3)}
+            self._last_mark = now
+
+    def expect(self, names, status: str = PENDING):
+        with self._lock:
+            for name in names:
+                self._steps.setdefault(name, {"status": status, "seconds": None})
+
+    def run(self, name: str, fn):
+        """Chạy fn, ghi thời gian và trạng thái; lỗi không làm chết app, chỉ báo FAILED."""
+        with self._lock:
+            self._steps[name] = {"status": RUNNING, "seconds": None}
+        start = time.perf_counter()
+        try:
+            fn()
+            step = {"status": READY}
+        except Exception as e:
+            step = {"status": FAILED, "error": str(e)}
+            print(f"❌ Startup step {name} failed: {e}")
+        step["seconds"] = round(time.perf_counter() - start, 3)
+        with self._lock:
+            self._steps[name] = step
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            steps = {name: dict(step) for name, step in self._steps.items()}
+        return {
+            "ready": all(step["status"] in (READY, LAZY) for step in steps.values()),
+            "uptime_seconds": round(time.perf_counter() - self._started, 3),
+            "steps": steps,
+        }
+
+    def summary(self) -> str:
+        return ", ".join(
+            f"{name} {step['seconds']}s" if step["seconds"] is not None else f"{name} {step['status']}"
+            for name, step in self.snapshot()["steps"].items()
+        )
+
+
+def warm_up(steps):
+    """steps: list (name, fn). Chạy tuần tự trong 1 thread riêng để app nhận request ngay."""
+    names = [name for name, _ in steps]
+    if not STARTUP_WARMUP:
+        startup_report.expect(names, status=LAZY)
+        return None
+
+    startup_report.expect(names)
+
+    def run():
+        for name, fn in steps:
+            startup_report.run(name, fn)
+        print(f"Startup: {startup_report.summary()}")
+
+    thread = threading.Thread(target=run, name="startup-warmup", daemon=True)
+    thread.start()
+    return thread
+
+
+startup_report = StartupReport()
@@ -0,0 +1,127 @@
+import os
+import time
+import functools
+from contextlib import nullcontext
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ==== CONFIG ====
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() in ("1", "true", "yes")
+
+try:
+    import prometheus_client
+except ImportError:  # chạy được không cần prometheus_client, chỉ là không có /metrics
+    prometheus_client = None
+
+ENABLED = TELEMETRY_ENABLED and prometheus_client is not None
+
+# Bucket (giây): LLM có thể mất vài chục giây, sqlite thường dưới 1ms
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+if ENABLED:
+    from prometheus_client import Counter, Histogram
+
+    RAG_STAGE_SECONDS = Histogram(
+        "rag_stage_seconds", "Latency of each ask_question stage",
+        ["stage"], buckets=STAGE_BUCKETS,
+    )
+    RAG_REQUEST_SECONDS = Histogram(
+        "rag_request_seconds", "End-to-end latency of query endpoints",
+        ["endpoint"], buckets=STAGE_BUCKETS,
+    )
+    RAG_CACHE_LOOKUPS = Counter(
+        "rag_cache_lookups_total", "Answer cache lookups by result", ["result"]
+    )
+    INGEST_STAGE_SECONDS = Histogram(
+        "ingest_stage_seconds", "Latency of each ingestion stage",
+        ["stage"], buckets=STAGE_BUCKETS,
+    )
+    INGEST_CHUNKS = Counter("ingest_chunks_total", "Chunks written by ingestion", ["action"])
+    DB_CALL_SECONDS = Histogram(
+        "db_call_seconds", "Latency of sqlite calls", ["op"], buckets=DB_BUCKETS,
+    )
+elif TELEMETRY_ENABLED:
+    print("prometheus_client is not installed, telemetry disabled.")
+
+_NOOP = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("_child", "_start")
+
+    def __init__(self, child):
+        self._child = child
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._child.observe(time.perf_counter() - self._start)
+        return False
+
+
+# -----------------------------
+# API dùng trong code (no-op khi tắt)
+# -----------------------------
+def rag_stage(stage: str):
+    """with rag_stage("retrieval"): ..."""
+    return _Timer(RAG_STAGE_SECONDS.labels(stage)) if ENABLED else _NOOP
+
+
+def rag_request(endpoint: str):
+    return _Timer(RAG_REQUEST_SECONDS.labels(endpoint)) if ENABLED else _NOOP
+
+
+def ingest_stage(stage: str):
+    return _Timer(INGEST_STAGE_SECONDS.labels(stage)) if ENABLED else _NOOP
+
+
+def db_call(op: str):
+    return _Timer(DB_CALL_SECONDS.labels(op)) if ENABLED else _NOOP
+
+
+def observe_rag_stage(stage: str, seconds: float):
+    if ENABLED:
+        RAG_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_ingest_stage(stage: str, seconds: float):
+    if ENABLED:
+        INGEST_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def count_cache_lookup(result: str):
+    if ENABLED:
+        RAG_CACHE_LOOKUPS.labels(result).inc()
+
+
+def count_ingest_chunks(action: str, n: int):
+    if ENABLED and n:
+        INGEST_CHUNKS.labels(action).inc(n)
+
+
+def timed_db(fn):
+    """Decorator cho hàm sqlite; khi tắt trả lại đúng hàm gốc (không tốn gì)."""
+    if not ENABLED:
+        return fn
+    child = DB_CALL_SECONDS.labels(fn.__name__)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            child.observe(time.perf_counter() - start)
+
+    return wrapper
+
+
+def render_metrics():
+    """(body, content_type) cho endpoint /metrics, None khi telemetry tắt."""
+    if not ENABLED:
+        return None
+    return prometheus_client.generate_latest(), prometheus_client.CONTENT_TYPE_LATEST
@@ -0,0 +1,23 @@
+import os
+import sys
+import pytest
+
+# Module backend import phẳng (from Database import ...) nên đưa BE/ vào sys.path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Database  # noqa: E402
+
+
+@pytest.fixture
+def db(tmp_path):
+    """Database trỏ vào file sqlite tạm, đã init_db; không đụng tới log.db thật."""
+    original = Database.DB_PATH
+    Database.DB_PATH = str(tmp_path / "test.db")
+    Database.init_db()
+    yield Database
+    Database.close_db_connections()
+    Database.DB_PATH = original
+
+
+def insert_log(db, question_id: str, similarity_score: float = 80.0) -> int:
+    return db.log_query(question_id, "user", "channel", f"question {question_id}", "answer", similarity_score)
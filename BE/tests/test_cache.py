@@ -0,0 +1,62 @@
+import time
+from cache import AnswerCache, normalize_question
+
+
+def make_cache(**kwargs) -> AnswerCache:
+    options = {"max_size": 8, "ttl": 60, "similarity_threshold": 0.95, **kwargs}
+    return AnswerCache(**options)
+
+
+def pending(answer: str) -> dict:
+    return {"answer": answer, "similarity_confidence": 60.0, "final_confidence": 60.0,
+            "confidence_pending": True}
+
+
+def test_exact_hit_uses_normalized_question():
+    cache = make_cache()
+    cache.put("How do I reset Windows?", [1, 0, 0], pending("do X"))
+    assert normalize_question("  how do I   RESET windows ?") == "how do i reset windows"
+    assert cache.get("how do I reset windows")["answer"] == "do X"
+    assert cache.get("something else") is None
+
+
+def test_semantic_hit_returns_matched_cache_key():
+    cache = make_cache()
+    cache.put("How do I reset Windows?", [1, 0, 0], pending("do X"))
+
+    hit = cache.get_similar([1, 0.01, 0])
+    assert hit["answer"] == "do X"
+    assert hit["cache_key"] == "how do i reset windows"
+    assert cache.get_similar([0, 1, 0]) is None
+
+    # Backfill qua cache_key cập nhật đúng entry gốc
+    assert cache.update(hit["cache_key"], "do X", {"confidence_pending": False, "final_confidence": 80.0})
+    assert cache.get("How do I reset Windows?")["confidence_pending"] is False
+    # answer khác (entry đã bị thay) thì không ghi đè
+    assert not cache.update(hit["cache_key"], "stale answer", {"final_confidence": 1.0})
+
+
+def test_lru_eviction_and_ttl():
+    cache = make_cache(max_size=2)
+    cache.put("a", [1, 0, 0], pending("A"))
+    cache.put("b", [0, 1, 0], pending("B"))
+    cache.get("a")
+    cache.put("c", [0, 0, 1], pending("C"))
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
+
+    expiring = make_cache(ttl=0.01)
+    expiring.put("a", [1, 0, 0], pending("A"))
+    time.sleep(0.02)
+    assert expiring.get("a") is None
+    assert expiring.get_similar([1, 0, 0]) is None
+
+
+def test_clear_invalidates_everything():
+    cache = make_cache()
+    cache.put("a", [1, 0, 0], pending("A"))
+    cache.clear()
+    assert cache.get("a") is None
+    assert cache.get_similar([1, 0, 0]) is None
+    assert cache.stats()["invalidations"] == 1
@@ -0,0 +1,164 @@
+import sqlite3
+import threading
+from datetime import datetime, timezone
+import Database
+from conftest import insert_log
+
+
+def daily_stats(db) -> dict:
+    rows = db.get_db_connection().execute(
+        "SELECT day, total_queries, escalated, thumbs_up, thumbs_down FROM daily_stats"
+    ).fetchall()
+    return {row[0]: tuple(row[1:]) for row in rows}
+
+
+def test_init_db_applies_all_migrations(db):
+    conn = db.get_db_connection()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db.MIGRATIONS[-1][0]
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(ingestion_logs)")}
+    assert {"content_hash", "payload", "worker_id", "heartbeat_at"} <= columns
+
+    # Chạy lại không lỗi và không đổi version
+    db.init_db()
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == db.MIGRATIONS[-1][0]
+
+
+def test_migrations_upgrade_legacy_db(tmp_path):
+    path = str(tmp_path / "legacy.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(
+        """
+        CREATE TABLE query_logs (
+            log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            question_id TEXT NOT NULL,
+            question TEXT NOT NULL,
+            channel_id TEXT NOT NULL,
+            user_id TEXT NOT NULL,
+            similarity_score REAL,
+            answer TEXT,
+            status TEXT DEFAULT 'answered',
+            flagged INTEGER DEFAULT 0,
+            thumbs_up INTEGER DEFAULT 0,
+            thumbs_down INTEGER DEFAULT 0,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE TABLE ingestion_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source TEXT NOT NULL,
+            document_id TEXT NOT NULL,
+            document_type TEXT,
+            document_name TEXT,
+            status TEXT NOT NULL,
+            last_modified TIMESTAMP,
+            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        );
+        INSERT INTO query_logs (question_id, question, channel_id, user_id, flagged, thumbs_up, thumbs_down, timestamp)
+        VALUES ('q1', 'a', 'c', 'u', 1, 0, 2, '2026-01-01 08:00:00'),
+               ('q2', 'b', 'c', 'u', 0, 3, 0, '2026-01-01 09:00:00'),
+               ('q3', 'c', 'c', 'u', 0, 1, 0, '2026-01-02 10:00:00');
+        INSERT INTO ingestion_logs (source, document_id, status) VALUES ('drive', 'doc1', 'success');
+        """
+    )
+    conn.commit()
+    conn.close()
+
+    original = Database.DB_PATH
+    Database.DB_PATH = path
+    try:
+        Database.init_db()
+        conn = Database.get_db_connection()
+        days = [row[0] for row in conn.execute("SELECT day FROM query_logs ORDER BY log_id")]
+        assert days == ["2026-01-01", "2026-01-01", "2026-01-02"]
+        assert daily_stats(Database) == {
+            "2026-01-01": (2, 1, 3, 2),
+            "2026-01-02": (1, 0, 1, 0),
+        }
+        assert Database.get_ingestion_history("doc1")[0]["content_hash"] is None
+    finally:
+        Database.close_db_connections()
+        Database.DB_PATH = original
+
+
+def test_daily_stats_follow_inserts_reactions_and_deletes(db):
+    insert_log(db, "q1", similarity_score=90)
+    insert_log(db, "q2", similarity_score=20)  # < 50 -> flagged
+    day = datetime.now(timezone.utc).date().isoformat()
+    assert daily_stats(db) == {day: (2, 1, 0, 0)}
+
+    assert db.apply_reaction_deltas({"q1": (0, 2), "q2": (1, 0)}) == []
+    # q1: down 2 > up 0 -> flagged; q2: up 1 > down 0 -> hết flagged
+    assert daily_stats(db) == {day: (2, 1, 1, 2)}
+
+    with db.transaction() as conn:
+        conn.execute("DELETE FROM query_logs WHERE question_id = 'q1'")
+    assert daily_stats(db) == {day: (1, 0, 1, 0)}
+
+    before = daily_stats(db)
+    db.backfill_daily_stats()
+    assert daily_stats(db) == before
+
+
+def test_reaction_deltas_clamp_and_report_missing(db):
+    insert_log(db, "q1")
+    assert db.apply_reaction_deltas({"q1": (-1, 1), "unknown": (1, 0)}) == ["unknown"]
+    row = db.get_db_connection().execute(
+        "SELECT thumbs_up, thumbs_down, flagged FROM query_logs WHERE question_id = 'q1'"
+    ).fetchone()
+    assert tuple(row) == (0, 1, 1)
+
+
+def test_allocate_log_ids_reserves_disjoint_blocks(db):
+    first = db.allocate_log_ids(10)
+    second = db.allocate_log_ids(5)
+    assert list(first) == list(range(1, 11))
+    assert list(second) == list(range(11, 16))
+
+    # Insert AUTOINCREMENT thường không được rơi vào block đã cấp
+    assert insert_log(db, "q1") == 16
+
+    with db.transaction() as conn:
+        db.insert_query_logs(conn, [db.query_log_row("q2", "u", "c", "q", "a", 70, log_id=first[0])])
+    assert db.allocate_log_ids(1)[0] == 17
+
+
+def test_enqueue_ingestion_job_is_atomic(db):
+    results = []
+
+    def enqueue():
+        results.append(db.enqueue_ingestion_job(
+            "drive", "doc1", "pdf", "a.pdf", None, {"kind": "drive"}
+        ))
+
+    threads = [threading.Thread(target=enqueue) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({job_id for job_id, _ in results}) == 1
+    assert sum(created for _, created in results) == 1
+
+    job = db.claim_next_ingestion_job("worker")
+    assert db.update_ingestion_job(job["id"], status="success", worker_id="worker", content_hash="md5")
+    job_id, created = db.enqueue_ingestion_job("drive", "doc1", "pdf", "a.pdf", None, {"kind": "drive"})
+    assert created and job_id != job["id"]
+    assert not db.should_ingest("doc1", None, "md5")
+    assert db.should_ingest("doc1", None, "other")
+
+
+def test_requeue_stale_jobs_only_touches_dead_workers(db):
+    db.enqueue_ingestion_job("drive", "doc1", "pdf", "a.pdf", None, {"kind": "drive"})
+    db.enqueue_ingestion_job("drive", "doc2", "pdf", "b.pdf", None, {"kind": "drive"})
+    dead = db.claim_next_ingestion_job("dead")
+    alive = db.claim_next_ingestion_job("alive")
+    with db.transaction() as conn:
+        conn.execute(
+            "UPDATE ingestion_logs SET heartbeat_at = '2000-01-01T00:00:00+00:00' WHERE id = ?",
+            (dead["id"],),
+        )
+
+    assert db.requeue_stale_jobs(60) == 1
+    assert db.get_ingestion_job(dead["id"])["status"] == "queued"
+    assert db.get_ingestion_job(alive["id"])["status"] == "running"
+    # Worker cũ không ghi đè được job đã bị requeue
+    assert not db.update_ingestion_job(dead["id"], status="success", worker_id="dead")
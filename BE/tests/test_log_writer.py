@@ -0,0 +1,48 @@
+from log_writer import QueryLogWriter
+
+
+def make_writer(id_block_size: int = 3) -> QueryLogWriter:
+    return QueryLogWriter(batch_size=2, flush_interval=0.05, queue_size=100,
+                          put_timeout=0.1, id_block_size=id_block_size)
+
+
+def test_log_returns_preallocated_ids_and_writes_them(db):
+    writer = make_writer()
+    writer.start()
+    ids = [writer.log(f"q{i}", "u", "c", "question", "answer", 80) for i in range(5)]
+    writer.update_confidence(ids[0], 30)
+    writer.stop()
+
+    assert ids == [1, 2, 3, 4, 5]
+    rows = db.get_db_connection().execute(
+        "SELECT log_id, question_id, similarity_score, flagged FROM query_logs ORDER BY log_id"
+    ).fetchall()
+    assert [row[0] for row in rows] == ids
+    assert [row[1] for row in rows] == [f"q{i}" for i in range(5)]
+    # confidence backfill < 50 -> flagged
+    assert (rows[0][2], rows[0][3]) == (30, 1)
+
+
+def test_log_ids_do_not_collide_with_direct_inserts(db):
+    writer = make_writer(id_block_size=10)
+    first = writer.log("q1", "u", "c", "question", "answer", 80)
+    direct = db.log_query("q2", "u", "c", "question", "answer", 80)
+    second = writer.log("q3", "u", "c", "question", "answer", 80)
+    writer.flush()
+
+    assert first == 1 and second == 2
+    assert direct == 11
+    count = db.get_db_connection().execute("SELECT COUNT(*) FROM query_logs").fetchone()[0]
+    assert count == 3
+
+
+def test_failed_row_does_not_drop_the_batch(db):
+    writer = make_writer()
+    good = writer.log("q1", "u", "c", "question", "answer", 80)
+    # Trùng primary key với dòng good -> chỉ dòng này lỗi
+    writer._put(("insert", db.query_log_row("dup", "u", "c", "question", "answer", 80, log_id=good)))
+    writer.log("q2", "u", "c", "question", "answer", 80)
+    writer.flush()
+
+    ids = [row[0] for row in db.get_db_connection().execute("SELECT question_id FROM query_logs")]
+    assert sorted(ids) == ["q1", "q2"]
@@ -0,0 +1,89 @@
+import threading
+import time
+import reaction_buffer
+from reaction_buffer import ReactionBuffer
+from conftest import insert_log
+
+
+def reactions(db, question_id: str) -> tuple:
+    row = db.get_db_connection().execute(
+        "SELECT thumbs_up, thumbs_down FROM query_logs WHERE question_id = ?", (question_id,)
+    ).fetchone()
+    return tuple(row)
+
+
+def test_events_are_coalesced_into_one_net_delta(db, monkeypatch):
+    calls = []
+    original = reaction_buffer.apply_reaction_deltas
+
+    def recording(deltas):
+        calls.append(dict(deltas))
+        return original(deltas)
+
+    monkeypatch.setattr(reaction_buffer, "apply_reaction_deltas", recording)
+    insert_log(db, "q1")
+    insert_log(db, "q2")
+    buffer = ReactionBuffer(flush_size=100, flush_interval=60, retry_limit=3)
+    buffer.add("q1", 1, 0)
+    buffer.add("q1", 1, 0)
+    buffer.add("q1", -1, 0)
+    buffer.add("q2", 0, 1)
+    buffer.add("q2", 0, -1)  # net 0 -> không ghi
+
+    assert buffer.flush() == 1
+    assert calls == [{"q1": (1, 0)}]
+    assert reactions(db, "q1") == (1, 0)
+    assert reactions(db, "q2") == (0, 0)
+
+
+def test_missing_row_is_retried_then_dropped(db):
+    buffer = ReactionBuffer(flush_size=100, flush_interval=60, retry_limit=3)
+    buffer.add("q1", 1, 0)
+    buffer.add("late", 0, 1)
+
+    assert buffer.flush() == 0
+    insert_log(db, "q1")
+    assert buffer.flush() == 1
+    assert reactions(db, "q1") == (1, 0)
+
+    # "late" hết retry_limit (3 lần flush không thấy dòng) thì bị bỏ
+    buffer.flush()
+    assert buffer.flush() == 0
+    insert_log(db, "late")
+    assert buffer.flush() == 0
+    assert reactions(db, "late") == (0, 0)
+
+
+def test_db_error_keeps_deltas_for_next_flush(db, monkeypatch):
+    insert_log(db, "q1")
+    buffer = ReactionBuffer(flush_size=100, flush_interval=60, retry_limit=3)
+    original = reaction_buffer.apply_reaction_deltas
+
+    def failing(deltas):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(reaction_buffer, "apply_reaction_deltas", failing)
+    buffer.add("q1", 1, 0)
+    assert buffer.flush() == 0
+
+    monkeypatch.setattr(reaction_buffer, "apply_reaction_deltas", original)
+    buffer.add("q1", 1, 0)
+    assert buffer.flush() == 1
+    assert reactions(db, "q1") == (2, 0)
+
+
+def test_stop_drains_until_rows_appear_or_deadline(db, capsys):
+    buffer = ReactionBuffer(flush_size=100, flush_interval=0.05, retry_limit=100, drain_timeout=1)
+    buffer.start()
+    buffer.add("q1", 1, 0)
+    buffer.add("never", 0, 1)
+    timer = threading.Timer(0.2, insert_log, args=(db, "q1"))
+    timer.start()
+
+    start = time.monotonic()
+    buffer.stop()
+    timer.join()
+
+    assert time.monotonic() - start < 2
+    assert reactions(db, "q1") == (1, 0)
+    assert "question_id never on shutdown" in capsys.readouterr().out
@@ -0,0 +1,37 @@
+import pytest
+from lexical import LexicalIndex, build_match_query
+
+
+def test_match_query_drops_stopwords_and_short_terms():
+    assert build_match_query("How do I fix error 0x80070005 in Windows?") == '"fix" OR "error" OR "0x80070005" OR "windows"'
+    # Toàn stopword thì vẫn giữ term gốc thay vì query rỗng
+    assert build_match_query("what is it") != ""
+
+
+def test_lexical_index_finds_exact_tokens(tmp_path):
+    index = LexicalIndex(str(tmp_path / "lexical.db"))
+    index.add(
+        ["c1", "c2", "c3"],
+        [
+            "Windows Update fails with error 0x80070005 access denied",
+            "Reset the network adapter from Settings",
+            "Install KB5005565 to fix printing",
+        ],
+        ["doc1", "doc1", "doc2"],
+    )
+    assert index.count() == 3
+    assert index.search("error 0x80070005", 2)[0] == "c1"
+    assert index.search("KB5005565", 2) == ["c3"]
+
+    index.delete(["c1"])
+    assert index.search("0x80070005", 2) == []
+    assert index.count() == 2
+
+
+def test_reciprocal_rank_fusion_prefers_documents_in_both_rankings():
+    bot = pytest.importorskip("bot", exc_type=ImportError)
+    fused = bot.reciprocal_rank_fusion([["a", "b", "c"], ["c", "d"]], k=60)
+    assert fused[0] == "c"
+    assert set(fused) == {"a", "b", "c", "d"}
+    # Hoà điểm giữ thứ tự danh sách đầu
+    assert bot.reciprocal_rank_fusion([["a", "b"], ["b", "a"]], k=60) == ["a", "b"]
@@ -0,0 +1,101 @@
+import os
+import threading
+import numpy as np
+import pytest
+import flat_index
+import ann_index
+from flat_index import export_flat_index, get_flat_index, FlatIndex
+
+
+class FakeCollection:
+    """Đủ interface count / get(limit, offset) của Chroma collection để export."""
+
+    def __init__(self, vectors):
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+        self.ids = [f"chunk-{i}" for i in range(len(self.vectors))]
+
+    def count(self):
+        return len(self.ids)
+
+    def get(self, include, limit, offset):
+        end = offset + limit
+        return {
+            "ids": self.ids[offset:end],
+            "embeddings": self.vectors[offset:end],
+            "documents": [f"text {i}" for i in range(offset, min(end, len(self.ids)))],
+            "metadatas": [{"row": i} for i in range(offset, min(end, len(self.ids)))],
+        }
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(300, 16)).astype(np.float32)
+
+
+def exact_top_k(vectors, queries, k):
+    unit = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.argsort(-(queries @ unit.T), axis=1)[:, :k]
+
+
+def test_flat_float32_matches_exact_search(tmp_path, vectors):
+    path = export_flat_index(FakeCollection(vectors), str(tmp_path), batch_size=64, build_hnsw=False)
+    index = FlatIndex(path)
+    assert index.count == len(vectors) and index.dim == vectors.shape[1]
+
+    queries = vectors[:10]
+    ids_per_query, rows = index.search(queries, 5)
+    expected = exact_top_k(vectors, queries, 5)
+    assert ids_per_query == [[f"chunk-{i}" for i in row] for row in expected]
+
+    text, metadata, vector = rows["chunk-0"]
+    assert text == "text 0" and metadata == {"row": 0}
+    assert np.isclose(np.linalg.norm(vector), 1.0, atol=1e-5)
+    assert set(index.get(["chunk-7", "missing"])) == {"chunk-7"}
+
+
+def test_flat_int8_keeps_top1_and_close_scores(tmp_path, vectors):
+    path = export_flat_index(FakeCollection(vectors), str(tmp_path), dtype="int8", build_hnsw=False)
+    index = FlatIndex(path)
+    assert index.dtype == "int8"
+
+    ids_per_query, rows = index.search(vectors[:20], 1)
+    assert [ids[0] for ids in ids_per_query] == [f"chunk-{i}" for i in range(20)]
+    unit = vectors[3] / np.linalg.norm(vectors[3])
+    assert np.allclose(rows["chunk-3"][2], unit, atol=0.02)
+
+
+def test_hnsw_recall_against_flat(tmp_path, vectors):
+    pytest.importorskip("hnswlib")
+    export_flat_index(FakeCollection(vectors), str(tmp_path), build_hnsw=True)
+    index = ann_index.get_ann_index(str(tmp_path))
+    assert isinstance(index, ann_index.HnswIndex)
+
+    queries = vectors[:50] + np.random.default_rng(1).normal(scale=0.1, size=(50, 16)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    ids_per_query, _ = index.search(queries, 5)
+    expected = exact_top_k(vectors, queries, 5)
+    recall = np.mean([
+        len({f"chunk-{i}" for i in row} & set(ids)) / 5 for row, ids in zip(expected, ids_per_query)
+    ])
+    assert recall >= 0.9
+
+
+def test_concurrent_exports_keep_current_and_prune_older(tmp_path, vectors, monkeypatch):
+    monkeypatch.setattr(flat_index, "FLAT_INDEX_RELOAD_INTERVAL", 0)
+    threads = [
+        threading.Thread(target=export_flat_index, args=(FakeCollection(vectors), str(tmp_path)),
+                         kwargs={"build_hnsw": False})
+        for _ in range(4)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    root = tmp_path / flat_index.FLAT_INDEX_DIR
+    versions = sorted(p.name for p in root.iterdir() if p.is_dir())
+    current = (root / flat_index.CURRENT_FILE).read_text()
+    assert len(versions) == flat_index.FLAT_INDEX_KEEP_VERSIONS
+    assert current == versions[-1]
+    assert not [p for p in os.listdir(root) if p.endswith(".tmp")]
+    assert get_flat_index(str(tmp_path)).version == current
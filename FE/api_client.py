@@ -4,9 +4,11 @@ import streamlit as st
 backend_url = "http://localhost:8000/"
 
 # ===================== GET METRIC API =====================
-def get_metrics():
+def get_metrics(page=1, page_size=50):
     try:
-        response = requests.get(f"{backend_url}get-metrics")
+        response = requests.get(
+            f"{backend_url}get-metrics", params={"page": page, "page_size": page_size}
+        )
         if response.status_code == 200:
             return response.json().get("metrics", {})
         else:
@@ -68,6 +70,19 @@ def ingest_local_files(files):
     return results
 
 
+def get_ingestion_job(job_id):
+    """
+    Lấy trạng thái / tiến độ của 1 job ingest
+    """
+    try:
+        response = requests.get(f"{backend_url}ingest-jobs/{job_id}")
+        response.raise_for_status()
+        return response.json().get("job", {})
+    except Exception as e:
+        st.error(f"❌ Error fetching ingestion job {job_id}: {str(e)}")
+        return {}
+
+
 def get_ingestion_history():
     """
     Lấy lịch sử ingestion từ backend    
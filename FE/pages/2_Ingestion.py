@@ -1,6 +1,7 @@
+import time
 import streamlit as st
 import pandas as pd
-from api_client import ingest_local_files, get_ingestion_history
+from api_client import ingest_local_files, get_ingestion_history, get_ingestion_job
 
 
 st.title("📂 Ingestion / Data Status")
@@ -18,13 +19,39 @@ uploaded_files = st.file_uploader(
 
 if uploaded_files:
     results = ingest_local_files(uploaded_files)
+    jobs = {}
     for res in results:
-        if res["status"] == "success":
-            st.success(f"✅ {res['file']} ingested successfully")
-        else:
+        if res["status"] != "success":
             st.error(f"❌ {res['file']} failed: {res.get('error', 'unknown error')}")
+            continue
+        for item in res["response"].get("results", []):
+            if item.get("job_id"):
+                jobs[item["job_id"]] = item["file"]
+            elif item["status"] == "skipped":
+                st.info(f"ℹ️ {item['file']} đã được ingest trước đó, bỏ qua.")
+            else:
+                st.error(f"❌ {item['file']} failed: {item.get('message', 'unknown error')}")
     results = []
 
+    # Poll trạng thái job cho tới khi xong
+    if jobs:
+        with st.status("Đang ingest...", expanded=True) as status_box:
+            pending = dict(jobs)
+            while pending:
+                for job_id, file_name in list(pending.items()):
+                    job = get_ingestion_job(job_id)
+                    if job.get("status") == "success":
+                        st.success(f"✅ {file_name} ingested successfully ({job.get('progress', 0)} chunks)")
+                        del pending[job_id]
+                    elif job.get("status") == "failed" or not job:
+                        st.error(f"❌ {file_name} failed: {job.get('message', 'unknown error')}")
+                        del pending[job_id]
+                    else:
+                        status_box.update(label=f"{file_name}: {job.get('message', job.get('status'))}")
+                if pending:
+                    time.sleep(2)
+            status_box.update(label="Ingestion finished", state="complete")
+
 
 # ================= Ingestion History =================
 history = get_ingestion_history()
@@ -6,11 +6,23 @@ from api_client import get_metrics
 
 st.title("🚨 Escalation / Alerts")
 
-df = pd.DataFrame(get_metrics().get("escalated_table", []))
+PAGE_SIZE = 50
+
+# Số trang lấy từ lần gọi trước (lần đầu chưa biết -> 1, rerun ngay khi có)
+max_page = st.session_state.get("escalation_total_pages", 1)
+page = st.number_input("Trang", min_value=1, max_value=max_page, value=1, step=1)
+metrics = get_metrics(page=page, page_size=PAGE_SIZE)
+df = pd.DataFrame(metrics.get("escalated_table", []))
+
+total_pages = max((metrics.get("escalated", 0) + PAGE_SIZE - 1) // PAGE_SIZE, 1)
+if metrics and total_pages != max_page:
+    st.session_state["escalation_total_pages"] = total_pages
+    st.rerun()
+page = metrics.get("page", page)
 
 if df.empty:
     st.info("✅ Chưa có câu hỏi nào bị escalate.")
 else:
-    st.subheader("Danh sách câu hỏi đã escalate")
+    st.subheader(f"Danh sách câu hỏi đã escalate (trang {page}/{total_pages})")
     st.dataframe(df)
     
\ No newline at end of file